@@ -1,9 +1,31 @@
+"""Car sharing to reduce CO2 (local search over the search.Problem interface)
+
+N users commute from an origin to a destination on a grid of streets; M of
+them are passengers and the rest drivers, who can take up to two passengers
+at a time without driving more than 300. CO2 is the Problem of assigning
+passengers to drivers so as to minimize the total distance driven.
+
+Run `python -m co2 --help` to solve random instances from the command line."""
+
 import search
+from utils import probability
 import random
 from enum import Enum
 import sys
-from itertools import product
+from itertools import product, accumulate, chain
+import argparse
 import copy
+import json
+import heapq
+import math
+import mmap
+import os
+from collections import defaultdict, OrderedDict
+import pickle
+import struct
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 
 
 def manhattan_distance(origin, destination):
@@ -21,31 +43,75 @@ class CO2(search.Problem):
         return state.is_final_state()
 
     def result(self, state, action):
-        act = action[0]
-        new_state = copy.deepcopy(state)
+        # The successor shares every driver with state; only the drivers the action
+        # modifies are cloned (with own_driver) before being changed.
+        new_state = state.successor()
+        act, a, b = self.encode_action(action)
+        new_state.own_driver(a)
+        if act == 'swap':
+            new_state.own_driver(b)
+        self.apply(new_state, action)
+        return new_state
 
+    def apply(self, state, action):
+        """Change state itself by the action. The drivers the action modifies must
+        not be shared with other states (see State.own_driver and State.copy)."""
+        act, a, b = self.encode_action(action)
+        driver = state.get_driver(a)
         if act == 'add':
-            old_driver, old_passenger = action[1:]
-            driver = new_state.get_driver(old_driver.user['id'])
-            passenger = new_state.get_user(old_passenger['id'])
-            new_state.add_passenger_to_driver(passenger,driver)
+            state.add_passenger_to_driver(state.get_user(b), driver)
         elif act == 'swap':
-            old_driver1, old_driver2 = action[1:]
-            driver1 = new_state.get_driver(old_driver1.user['id'])
-            driver2 = new_state.get_driver(old_driver2.user['id'])
-            new_state.swap_best_passengers(driver1, driver2)
+            state.swap_best_passengers(driver, state.get_driver(b))
         elif act == 'driver_as_passenger':
-            old_driver, old_driver_as_passenger = action[1:]
-            driver = new_state.get_driver(old_driver.user['id'])
-            driver_as_passenger = new_state.get_driver(old_driver_as_passenger.user['id'])
-            new_state.add_driver_as_passenger(driver, driver_as_passenger)
-
-        return new_state
+            state.add_driver_as_passenger(driver, state.get_driver(b))
+        elif act == 'remove':
+            state.remove_passenger_from_driver(state.get_user(b), driver)
 
     def value(self, state):
         # print(state.global_distance())
         return state.N * 300 - state.global_distance()
 
+    def distance_delta(self, state, action):
+        """Return how much state.global_distance() would change if the action were
+        applied, looking only at the routes of the drivers the action touches."""
+        act = action[0]
+        if act == 'add':
+            driver = state.get_driver(action[1].user['id'])
+            best = driver.best_insertion(action[2])
+            if best is None:
+                return 0
+            return best['dist'] - driver.distance() - state.MAX_DRIVE_DISTANCE
+        elif act == 'swap':
+            driver1 = state.get_driver(action[1].user['id'])
+            driver2 = state.get_driver(action[2].user['id'])
+            best = state.best_swap(driver1, driver2)
+            if best is None:
+                return 0
+            return best['dist'] - driver1.distance() - driver2.distance()
+        elif act == 'driver_as_passenger':
+            driver = state.get_driver(action[1].user['id'])
+            driver_as_passenger = state.get_driver(action[2].user['id'])
+            best = driver.best_insertion(driver_as_passenger.user)
+            if best is None:
+                return 0
+            return best['dist'] - driver.distance() - driver_as_passenger.distance()
+        elif act == 'remove':
+            driver = state.get_driver(action[1].user['id'])
+            if not driver.has_passenger(action[2]):
+                return 0
+            rider = state.get_driver(action[2]['id'])
+            waiting = state.MAX_DRIVE_DISTANCE if rider is None else rider.distance()
+            return driver.removal_distance(action[2]) - driver.distance() + waiting
+        return 0
+
+    def value_delta(self, state, action):
+        """value(result(state, action)) - value(state), without building the result."""
+        return -self.distance_delta(state, action)
+
+    def cache_hits(self, state):
+        """Hits of the RouteCache of the state so far (see search.ObservedProblem)."""
+        return state.route_cache.hits if state.route_cache is not None else 0
+
     def actions(self, state):
         actions = self.generate_add_passenger_actions(state)
         if len(state.actual_drivers) > 1:
@@ -57,9 +123,35 @@ class CO2(search.Problem):
         return actions
 
     def generate_add_passenger_actions(self, state):
+        """'add' actions for the pairs of driver and remaining passenger that may fit.
+        Inserting a point x in a route leg from a to b adds |a-x| + |x-b| - |a-b|,
+        twice the distance from x to the bounding box of a and b, so taking a
+        passenger adds at least twice the distance from its origin (and from its
+        destination) to the bounding box of the whole route. Pairs where that
+        exceeds the driver's slack would be rejected by add_passenger and are not
+        generated; a UserGrid over the passengers' origins finds the others."""
         actions = []
-        for d, p in product(state.drivers, state.remaining_passengers):
-            actions.append(['add',d,p])
+        if not state.remaining_passengers:
+            return actions
+        if not isinstance(state.table.oracle, ManhattanDistance):
+            return [['add', d, p] for d in state.actual_drivers for p in state.remaining_passengers]
+        xs, ys = state.table.xs, state.table.ys
+        grid = UserGrid(state.table, state.remaining_passengers,
+                        max(1, state.NUM_STREETS // 16))
+        for d in state.actual_drivers:
+            slack = d.slack()
+            if slack < 0:
+                continue
+            box = d.bounds()
+            reach = slack // 2
+            if farthest_box_distance(box, grid.bounds) <= reach:
+                actions.extend(['add', d, p] for p in state.remaining_passengers)
+                continue
+            for p in grid.within(box[0] - reach, box[1] - reach, box[2] + reach, box[3] + reach):
+                o, e = 2 * p['id'], 2 * p['id'] + 1
+                if box_distance(xs[o], ys[o], box) <= reach and \
+                        box_distance(xs[e], ys[e], box) <= reach:
+                    actions.append(['add',d,p])
         return actions
 
     def generate_swap_actions(self, state):
@@ -77,13 +169,713 @@ class CO2(search.Problem):
             actions.append(['driver_as_passenger', d, p])
         return actions
 
+    def random_action(self, state, remove=0.0):
+        """Draw one action without enumerating them, or None if there are none:
+        uniformly over every (driver, remaining rider) 'add' pair, which unlike
+        actions(state) includes the ones pruned as infeasible (they score 0),
+        and every 'swap' and 'driver_as_passenger' action. With probability `remove` draw instead a
+        'remove' action, which takes a random rider out of a random busy driver:
+        it never improves the state, so it is not in actions(), but it lets
+        simulated annealing and tabu search leave local optima."""
+        actual = state.actual_drivers
+        remaining, idle = state.remaining_passengers, state.drivers_with_no_passengers
+        busy = len(actual) - len(idle)
+        if remove and busy and random.random() < remove:
+            driver = self.__random_busy_driver(state)
+            return ['remove', driver, random.choice(driver.get_passengers())]
+        adds = len(actual) * len(remaining)
+        swaps = busy * (busy - 1)
+        carries = len(actual) * len(idle) - len(idle) if not remaining else 0
+        k = random.randrange(adds + swaps + carries) if adds + swaps + carries else None
+        if k is None:
+            return None
+        elif k < adds:
+            return ['add', actual[k // len(remaining)], remaining[k % len(remaining)]]
+        elif k < adds + swaps:
+            driver1 = driver2 = self.__random_busy_driver(state)
+            while driver2 is driver1:
+                driver2 = self.__random_busy_driver(state)
+            return ['swap', driver1, driver2]
+        else:
+            driver = rider = random.choice(idle)
+            while driver is rider:
+                driver = random.choice(actual)
+            return ['driver_as_passenger', driver, rider]
+
+    def __random_busy_driver(self, state):
+        # Rejection sampling: O(1) expected while a fair share of the drivers is busy
+        while True:
+            driver = random.choice(state.actual_drivers)
+            if len(driver.ids):
+                return driver
+
+    def encode_action(self, action):
+        """Return the action as a tuple of ints, e.g. to send it to another process."""
+        act, a, b = action
+        return act, a.user['id'], b['id'] if act in ('add', 'remove') else b.user['id']
+
+    def decode_action(self, state, code):
+        """Inverse of encode_action: the action on the drivers and users of state."""
+        act, a, b = code
+        return [act, state.get_driver(a),
+                state.get_user(b) if act in ('add', 'remove') else state.get_driver(b)]
+
+
+class ObservedCO2(search.ObservedProblem):
+    """A search.ObservedProblem that also counts and times the calls of the
+    delta searches: random_action generates an action, apply builds a successor
+    (in place) and value_delta is timed as value. Neighbors scored on an
+    executor are not timed."""
+
+    def random_action(self, state, remove=0.0):
+        action = self.problem.random_action(state, remove)
+        self.actions_generated += action is not None
+        return action
+
+    def apply(self, state, action):
+        start = time.perf_counter()
+        self.problem.apply(state, action)
+        self.result_time += time.perf_counter() - start
+        self.successors += 1
+
+    def value_delta(self, state, action):
+        start = time.perf_counter()
+        delta = self.problem.value_delta(state, action)
+        self.value_time += time.perf_counter() - start
+        return delta
+
+
+def _score_actions(payload, codes):
+    """Worker side of parallel_value_deltas: value_delta of every encoded action."""
+    state = pickle.loads(payload)
+    problem = CO2(state)
+    return [problem.value_delta(state, problem.decode_action(state, code)) for code in codes]
+
+
+def parallel_value_deltas(problem, state, actions, executor, shards=None):
+    """problem.value_delta of every action, scored in shards on a
+    concurrent.futures executor. The state is pickled once and every shard
+    receives those bytes plus its actions encoded as tuples of ints. The
+    RouteCache of the state is not sent: each shard fills an empty one of its
+    own, and its hits and misses are not merged into the state's cache."""
+    shards = shards or os.cpu_count() or 1
+    payload = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+    codes = [problem.encode_action(action) for action in actions]
+    size = -(-len(codes) // shards)
+    futures = [executor.submit(_score_actions, payload, codes[i:i+size])
+               for i in range(0, len(codes), size)]
+    return [delta for future in futures for delta in future.result()]
+
+
+class Checkpointer:
+    """Saves the incumbent state of a search to a file, with the number of the
+    step, every `steps` steps or every `seconds` seconds, whichever comes first.
+    A save is put off while saving has taken more than `overhead` of the time
+    since the checkpointer was created, so checkpoints cost at most about that
+    share of the run. The file is replaced atomically; load reads it back."""
+
+    def __init__(self, path, steps=None, seconds=60, overhead=0.01):
+        self.path = path
+        self.steps = steps
+        self.seconds = seconds
+        self.overhead = overhead
+        self.start = self.last_time = time.perf_counter()
+        self.last_step = 0
+        self.saves = 0
+        self.save_seconds = 0.0
+
+    def __call__(self, step, state):
+        """Save the state if a checkpoint is due after the step."""
+        now = time.perf_counter()
+        due = (self.steps is not None and step - self.last_step >= self.steps) or \
+            (self.seconds is not None and now - self.last_time >= self.seconds)
+        if due and self.save_seconds <= self.overhead * (now - self.start):
+            self.save(step, state)
+
+    def save(self, step, state):
+        start = time.perf_counter()
+        with open(self.path + '.tmp', 'wb') as f:
+            f.write(struct.pack('<Q', step))
+            f.write(state.dumps())
+        os.replace(self.path + '.tmp', self.path)
+        self.last_time = time.perf_counter()
+        self.last_step = step
+        self.saves += 1
+        self.save_seconds += self.last_time - start
+
+    @staticmethod
+    def load(path, oracle=None, route_cache=None):
+        """The step and the state saved in the file (see State.loads)."""
+        with open(path, 'rb') as f:
+            data = f.read()
+        step, = struct.unpack_from('<Q', data)
+        return step, State.loads(data[8:], oracle, route_cache)
+
+
+def delta_hill_climbing(problem, executor=None, shards=None, deadline=None, observer=None,
+                        checkpoint=None, start=0, rng=random):
+    """Like search.hill_climbing, but every neighbor is scored with
+    problem.value_delta and a successor is only built for the chosen move.
+    With an executor (e.g. a ProcessPoolExecutor) the neighbors are scored in
+    parallel by parallel_value_deltas; the result is the same. No step is
+    started after the time.time() deadline, if one is given. Each step is
+    reported to the observer (a search.SearchObserver), if one is given, and
+    the current state is passed to checkpoint (a Checkpointer), if one is given.
+    To resume from a checkpoint, start from its state at its step. Ties are
+    broken with rng (the random module or a random.Random)."""
+    if observer is not None:
+        value = problem.value(problem.initial)
+        problem = ObservedCO2(problem)
+    current = problem.initial
+    step = start
+    while deadline is None or time.time() < deadline:
+        actions = problem.actions(current)
+        if not actions:
+            break
+        if executor is None:
+            deltas = [problem.value_delta(current, action) for action in actions]
+        else:
+            deltas = parallel_value_deltas(problem, current, actions, executor, shards)
+        order = list(range(len(actions)))
+        rng.shuffle(order)
+        best = max(order, key=deltas.__getitem__)
+        if deltas[best] <= 0:
+            break
+        current = problem.result(current, actions[best])
+        step += 1
+        if observer is not None:
+            value += deltas[best]
+            observer.step(step, value, **problem.stats(current))
+        if checkpoint is not None:
+            checkpoint(step, current)
+    return current
+
+
+def delta_simulated_annealing(problem, schedule=search.exp_schedule(k=100, lam=0.0005, limit=20000),
+                              remove=0.1, deadline=None, observer=None, checkpoint=None,
+                              start=0):
+    """search.simulated_annealing on a single mutable state: each step draws one
+    action with problem.random_action, scores it with problem.value_delta and,
+    if it is accepted, applies it in place with problem.apply. So a step costs
+    about as much as scoring one move, instead of building every successor.
+    Unlike search.simulated_annealing, it returns the best state it has seen.
+    Each step is reported to the observer (a search.SearchObserver), if one is
+    given, and the best state is passed to checkpoint (a Checkpointer), if one
+    is given. To resume from a checkpoint, start from its state at its step."""
+    if observer is not None:
+        problem = ObservedCO2(problem)
+    current = problem.initial.copy()
+    value = best_value = problem.value(current)
+    best = current.copy()
+    for t in range(start, sys.maxsize):
+        T = schedule(t)
+        if T == 0 or (deadline is not None and time.time() >= deadline):
+            break
+        action = problem.random_action(current, remove)
+        if action is None:
+            break
+        delta_e = problem.value_delta(current, action)
+        if delta_e > 0 or probability(math.exp(delta_e / T)):
+            problem.apply(current, action)
+            value += delta_e
+            if value > best_value:
+                best, best_value = current.copy(), value
+        if observer is not None:
+            observer.step(t + 1, best_value, **problem.stats(current))
+        if checkpoint is not None:
+            checkpoint(t + 1, best)
+    return best
+
+
+def _reverse_codes(code):
+    """Encoded actions that would undo the encoded action."""
+    act, a, b = code
+    if act == 'add':
+        return [('remove', a, b)]
+    elif act == 'remove':
+        # the rider taken out may be a driver, put back by driver_as_passenger
+        return [('add', a, b), ('driver_as_passenger', a, b)]
+    elif act == 'swap':
+        return [('swap', a, b), ('swap', b, a)]
+    elif act == 'driver_as_passenger':
+        return [('remove', a, b)]
+    return []
+
+
+def tabu_search(problem, iterations=2000, candidates=30, tenure=20, remove=0.1, deadline=None,
+                observer=None, checkpoint=None, start=0, tabu_states=False):
+    """Each iteration applies the best of `candidates` random actions, even if
+    it makes the state worse, unless it undoes one of the last `tenure` moves
+    (or, with tabu_states, leads back to one of the last `tenure` states) and
+    does not beat the best state. Returns the best state found. Each iteration is
+    reported to the observer (a search.SearchObserver), if one is given, and
+    the best state is passed to checkpoint (a Checkpointer), if one is given.
+    To resume from a checkpoint, start from its state at its iteration; the
+    tabu list starts empty."""
+    if observer is not None:
+        problem = ObservedCO2(problem)
+    current = problem.initial.copy()
+    value = best_value = problem.value(current)
+    best = current.copy()
+    tabu = {}  # encoded action, or state fingerprint -> iteration until which it is tabu
+    for i in range(start, iterations):
+        if deadline is not None and time.time() >= deadline:
+            break
+        chosen, chosen_delta, chosen_state = None, None, None
+        for _ in range(candidates):
+            action = problem.random_action(current, remove)
+            if action is None:
+                break
+            delta = problem.value_delta(current, action)
+            if chosen is not None and delta <= chosen_delta:
+                continue
+            aspiring = value + delta > best_value
+            if tabu_states:
+                # told by State.fingerprint, which also catches cycles of several moves
+                successor = problem.result(current, action)
+                if not aspiring and tabu.get(hash(successor), -1) >= i:
+                    continue
+                chosen_state = successor
+            elif not aspiring and tabu.get(problem.encode_action(action), -1) >= i:
+                continue
+            chosen, chosen_delta = action, delta
+        if chosen is not None:
+            if tabu_states:
+                tabu[hash(current)] = i + tenure
+                current = chosen_state
+            else:
+                code = problem.encode_action(chosen)
+                problem.apply(current, chosen)
+                for reverse in _reverse_codes(code):
+                    tabu[reverse] = i + tenure
+            value += chosen_delta
+            if value > best_value:
+                best, best_value = current.copy(), value
+        if observer is not None:
+            observer.step(i + 1, best_value, **problem.stats(current))
+        if checkpoint is not None:
+            checkpoint(i + 1, best)
+    return best
+
+
+def _riders(state):
+    """(rider, driver id) for every user riding with an actual driver."""
+    return [(rider, d.user['id']) for d in state.actual_drivers for rider in d.get_passengers()]
+
+
+def _destroy_random(state, riders, q):
+    return random.sample(riders, q)
+
+
+def _destroy_worst(state, riders, q, p=3):
+    """Riders whose detour is among the longest: the i-th longest is taken with
+    a probability that falls with i, more steeply the larger p is."""
+    detour = {rider['id']: state.get_driver(d).distance()
+              - state.get_driver(d).removal_distance(rider) for rider, d in riders}
+    riders = sorted(riders, key=lambda r: -detour[r[0]['id']])
+    return [riders.pop(int(random.random()**p * len(riders))) for _ in range(q)]
+
+
+def _destroy_related(state, riders, q):
+    """A random rider and the q - 1 riders whose origins and destinations are
+    nearest to its own."""
+    table = state.table
+    seed = random.choice(riders)[0]['id']
+    origins = table.distances(2*seed, [2*rider['id'] for rider, _ in riders])
+    destinations = table.distances(2*seed + 1, [2*rider['id'] + 1 for rider, _ in riders])
+    nearest = sorted(range(len(riders)), key=lambda i: origins[i] + destinations[i])
+    return [riders[i] for i in nearest[:q]]
+
+
+DESTROY = {'random': _destroy_random, 'worst': _destroy_worst, 'related': _destroy_related}
+
+
+def repair(state, users, regret=1, owned=()):
+    """Insert the waiting users into the actual drivers of state while that
+    shortens the global distance, cheapest first (regret=1) or by regret-k
+    insertion, and return the number of insertions scored. Drivers whose ids
+    are not in `owned` are owned by state (see State.own_driver) first."""
+    pending = {user['id']: user for user in users}
+    saving = {id: state.MAX_DRIVE_DISTANCE if state.get_driver(id) is None
+              else state.get_driver(id).distance() for id in pending}
+    targets = {d.user['id'] for d in state.actual_drivers}
+    costs = {}  # driver id -> {user id: cost of its best insertion}
+    owned = set(owned)
+    scored = 0
+
+    def score(id):
+        driver = state.get_driver(id)
+        users = [u for u in pending.values() if u['id'] != id]
+        base = driver.distance()
+        costs[id] = {u['id']: insertion['dist'] - base - saving[u['id']]
+                     for u, insertion in zip(users, driver.insertions(users))
+                     if insertion is not None}
+        return len(users)
+
+    for id in targets:
+        scored += score(id)
+    while pending:
+        choice, choice_key = None, None
+        for user in pending:
+            if state.get_driver(user) is not None and state.get_driver(user).ids:
+                continue  # it drives its own passengers now
+            options = sorted((c[user], id) for id, c in costs.items()
+                             if user in c and c[user] < 0)
+            if not options:
+                continue
+            # regret-k places first the user that would lose most by waiting: the
+            # sum of the differences between its k - 1 next cheapest drivers and
+            # its cheapest one
+            key = options[0][0] if regret == 1 else \
+                (-sum(c - options[0][0] for c, _ in options[1:regret])
+                 - max(0, regret - len(options)) * state.MAX_DRIVE_DISTANCE, options[0][0])
+            if choice is None or key < choice_key:
+                choice, choice_key = (user, options[0][1]), key
+        if choice is None:
+            break
+        user, id = choice
+        if id not in owned:
+            state.own_driver(id)
+            owned.add(id)
+        driver = state.get_driver(id)
+        if state.get_driver(user) is None:
+            state.add_passenger_to_driver(pending.pop(user), driver)
+        else:
+            del pending[user]
+            state.add_driver_as_passenger(driver, state.get_driver(user))
+            del costs[user]
+        for c in costs.values():
+            c.pop(user, None)
+        scored += score(id)
+    return scored
+
+
+def large_neighborhood_search(problem, iterations=1000, remove=10, destroy='random',
+                              regret=1, deadline=None, observer=None, checkpoint=None, start=0):
+    """Destroy and repair: each iteration takes `remove` riders out of their
+    drivers, chosen by DESTROY[destroy] (at random, among the longest detours
+    or near one another), and puts them back with repair (greedy for regret=1,
+    regret-k insertion otherwise), together with the passengers who were
+    already waiting. The changed drivers are owned by a successor of the
+    current state, which replaces it unless its global_distance is longer.
+    Returns the best state found. Each iteration is reported to the observer
+    (a search.SearchObserver), if one is given, and the best state is passed to
+    checkpoint (a Checkpointer), if one is given. To resume from a checkpoint,
+    start from its state at its iteration."""
+    current = best = problem.initial
+    for i in range(start, iterations):
+        if deadline is not None and time.time() >= deadline:
+            break
+        began = time.perf_counter()
+        riders = _riders(current)
+        state = current.successor()
+        removed = DESTROY[destroy](current, riders, min(remove, len(riders))) if riders else []
+        owned = set()
+        for rider, id in removed:
+            if id not in owned:
+                state.own_driver(id)
+                owned.add(id)
+            state.remove_passenger_from_driver(rider, state.get_driver(id))
+        destroyed = time.perf_counter()
+        waiting = [rider for rider, _ in removed] + \
+            [u for u in state.remaining_passengers if all(u is not r for r, _ in removed)]
+        scored = repair(state, waiting, regret, owned)
+        repaired = time.perf_counter()
+        if state.global_distance() <= current.global_distance():
+            current = state
+            if current.global_distance() < best.global_distance():
+                best = current
+        if observer is not None:
+            observer.step(i + 1, problem.value(best), actions=scored, successors=1,
+                          result_seconds=round(destroyed - began, 6),
+                          value_seconds=round(repaired - destroyed, 6), cache_hits=0)
+        if checkpoint is not None:
+            checkpoint(i + 1, best)
+    return best
+
+
+def perturb(state, k, rng=random):
+    """Return a successor of state in which up to k riders, drawn with rng, have
+    been taken out of their drivers."""
+    new_state = state.successor()
+    for _ in range(k):
+        busy = [d for d in new_state.actual_drivers if d.get_passengers()]
+        if not busy:
+            break
+        driver = new_state.own_driver(rng.choice(busy).user['id'])
+        new_state.remove_passenger_from_driver(rng.choice(driver.get_passengers()), driver)
+    return new_state
+
+
+def _restart(problem, seed, perturbation, deadline):
+    """One climb of random_restart_hill_climbing."""
+    rng = random.Random(seed)
+    if perturbation:
+        problem = CO2(perturb(problem.initial, perturbation, rng))
+    return delta_hill_climbing(problem, deadline=deadline, rng=rng)
+
+
+def random_restart_hill_climbing(problem, restarts=8, executor=None, batch=None,
+                                 time_budget=None, seed=None, perturbation=0):
+    """Run up to `restarts` climbs of delta_hill_climbing and return the final
+    state with the lowest global_distance. Climbs differ in the random seed that
+    breaks their ties; with perturbation > 0 all but the first start from the
+    incumbent with that many riders taken out, so the first climb then runs on
+    its own. Climbs are run in batches (of os.cpu_count() by default), on the
+    executor if one is given. After
+    time_budget seconds no climb is started and the running ones stop at their
+    next step."""
+    rng = random.Random(seed)
+    deadline = time.time() + time_budget if time_budget is not None else None
+    batch = batch or os.cpu_count() or 1
+    best = None
+    while restarts > 0 and (deadline is None or time.time() < deadline):
+        if best is None:
+            start, size = problem, 1 if perturbation else min(batch, restarts)
+        else:
+            start, size = CO2(best) if perturbation else problem, min(batch, restarts)
+        jobs = [(start, rng.randrange(2**32), perturbation if best else 0, deadline)
+                for _ in range(size)]
+        restarts -= len(jobs)
+        if executor is None:
+            finals = [_restart(*job) for job in jobs]
+        else:
+            finals = [future.result() for future in
+                      [executor.submit(_restart, *job) for job in jobs]]
+        for state in finals:
+            if best is None or state.global_distance() < best.global_distance():
+                best = state
+    return best
+
+
+def optimal_route(table, driver, riders, capacity=2, max_distance=None):
+    """Shortest route for the driver (a user id) that takes and drops every rider
+    (user ids) with at most `capacity` of them in the car at a time, by dynamic
+    programming over the (taken, dropped) subsets of riders and the last stop.
+    Return (distance, ids, ops) with ids and ops as in Driver, or None if every
+    such route is longer than max_distance."""
+    # distances between the points of the route, numbered 0 (start), 2i+1 and
+    # 2i+2 (origin and destination of the i-th rider) and 2n+1 (end)
+    points = [2*driver] + list(chain.from_iterable((2*r, 2*r + 1) for r in riders))
+    points.append(2*driver + 1)
+    between = [table.distances(p, points) for p in points]
+    to_end = [row[-1] for row in between]
+    limit = max_distance if max_distance is not None else float('inf')
+    stops = [(1 << i, 2*i + 1, 2*i + 2, r) for i, r in enumerate(riders)]
+    in_car = [bin(mask).count('1') for mask in range(1 << len(riders))]
+    # layers[k] maps (taken, dropped, last point) after k stops to
+    # (distance so far, key in layers[k - 1], (rider, op) of the last stop)
+    layers = [{(0, 0, 0): (0, None, None)}]
+    for _ in range(2 * len(riders)):
+        layer = {}
+        for key, (dist, _, _) in layers[-1].items():
+            taken, dropped, point = key
+            row = between[point]
+            room = in_car[taken & ~dropped] < capacity
+            for b, origin, destination, rider in stops:
+                if not taken & b:
+                    if not room:
+                        continue
+                    new_key, stop = (taken | b, dropped, origin), (rider, TAKE)
+                elif not dropped & b:
+                    new_key, stop = (taken, dropped | b, destination), (rider, DROP)
+                else:
+                    continue
+                p = new_key[2]
+                new_dist = dist + row[p]
+                if new_dist + to_end[p] > limit:
+                    continue
+                if new_key not in layer or new_dist < layer[new_key][0]:
+                    layer[new_key] = (new_dist, key, stop)
+        if not layer:
+            return None
+        layers.append(layer)
+    last = layers[-1]
+    key = min(last, key=lambda k: last[k][0] + to_end[k[2]])
+    distance = last[key][0] + to_end[key[2]]
+    if distance > limit:
+        return None
+    stops = []
+    for layer in reversed(layers[1:]):
+        _, key, stop = layer[key]
+        stops.append(stop)
+    stops.reverse()
+    return distance, [id for id, _ in stops], [op for _, op in stops]
+
+
+class RouteCache:
+    """A least recently used cache of optimal_route keyed by the driver and the
+    set of its riders, to be shared by all the states of a search (which share
+    their users). It holds at most maxsize routes and counts hits and misses."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.routes = OrderedDict()
+        self.hits = self.misses = 0
+
+    def route(self, driver, riders):
+        """optimal_route of the Driver with the riders (ids), or None."""
+        key = (driver.user['id'], frozenset(riders))
+        if key in self.routes:
+            self.hits += 1
+            self.routes.move_to_end(key)
+            return self.routes[key]
+        self.misses += 1
+        route = self.routes[key] = optimal_route(driver.table, key[0], sorted(key[1]),
+                                                 driver.capacity, driver.max_distance)
+        if len(self.routes) > self.maxsize:
+            self.routes.popitem(last=False)
+        return route
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.routes),
+                'maxsize': self.maxsize}
+
+    def __getstate__(self):
+        # A pickled cache, such as the one of a state sent to a worker process,
+        # starts out empty: the routes would dwarf the state
+        return {'maxsize': self.maxsize}
+
+    def __setstate__(self, state):
+        self.__init__(state['maxsize'])
+
+
+def branch_and_bound(state, incumbent=None):
+    """Return a state with the minimum global_distance over every way of giving
+    riders to the drivers of `state` with optimal routes, or incumbent (a known
+    solution) if nothing is better: an exact solver for some 20 to 25 users."""
+    table, limit = state.table, state.MAX_DRIVE_DISTANCE
+    drivers = [d.user['id'] for d in state.drivers]
+    passengers = [p['id'] for p in state.passengers]
+    alone = {d: table.point_distance(2*d, 2*d + 1) for d in drivers}
+    drivers.sort(key=lambda d: -alone[d])
+    users = drivers + passengers
+    bit = {u: 1 << i for i, u in enumerate(users)}
+    routes = {}  # (driver, frozenset of riders) -> optimal_route
+    even = dict.fromkeys(drivers, float('inf'))
+    even.update(dict.fromkeys(passengers, limit))
+    detour = dict(alone)
+    detour.update(dict.fromkeys(passengers, limit))
+    # The sets of riders whose optimal_route is short enough are closed under
+    # taking subsets, so they are grown one rider at a time
+    for d in drivers:
+        driver = state.get_driver(d)
+        routes[d, frozenset()] = (alone[d], [], [])
+        layer = [frozenset()]
+        while layer:
+            next_layer = set()
+            for riders in layer:
+                for u in users:
+                    grown = riders | {u}
+                    if u == d or u in riders or grown in next_layer or \
+                            any((d, grown - {v}) not in routes for v in riders):
+                        continue
+                    route = optimal_route(table, d, sorted(grown), driver.capacity,
+                                          driver.max_distance)
+                    if route is not None:
+                        routes[d, grown] = route
+                        next_layer.add(grown)
+            layer = next_layer
+    # A car is no better than taking one of its riders out, to wait or to drive
+    # alone, if that rider adds as much distance
+    own = dict(alone)
+    own.update(dict.fromkeys(passengers, limit))
+    routes = {(d, riders): route for (d, riders), route in routes.items()
+              if all(route[0] - routes[d, riders - {r}][0] < own[r] for r in riders)}
+    for (d, riders), (dist, _, _) in routes.items():
+        even[d] = min(even[d], dist / (len(riders) + 1))
+        for u in riders:
+            even[u] = min(even[u], dist / (len(riders) + 1))
+            detour[u] = min(detour[u], (dist - alone[d]) / len(riders))
+    # The search is bounded by charging every user left the least it can be
+    # charged when the distance of a car is split among its users: evenly, or
+    # the distance the driver would drive alone and the detour evenly for the
+    # riders. Both ways leave every car at least as long as the charges of its
+    # users; raise the charges of the users one by one while that holds, by the
+    # least slack of the cars they can be in
+    all_cars = [(dist, riders | {d}) for (d, riders), (dist, _, _) in routes.items()]
+    for charges in (even, detour):
+        slack = [dist - sum(charges[u] for u in car) for dist, car in all_cars]
+        for u in users:
+            raise_by = min((slack[i] for i, (_, car) in enumerate(all_cars) if u in car),
+                           default=float('inf'))
+            if u in passengers:
+                raise_by = min(raise_by, limit - charges[u])
+            charges[u] += raise_by
+            for i, (_, car) in enumerate(all_cars):
+                if u in car:
+                    slack[i] -= raise_by
+    cars_of = defaultdict(list)  # user -> [(car mask, distance, driver, riders, charges)]
+    for (d, riders), (dist, _, _) in routes.items():
+        car = riders | {d}
+        option = (sum(bit[u] for u in car), dist, d, riders,
+                  sum(even[u] for u in car), sum(detour[u] for u in car))
+        for u in car:
+            cars_of[u].append(option)
+    for options in cars_of.values():
+        options.sort(key=lambda option: option[1] - option[4])
+    budget = incumbent.global_distance() if incumbent else float('inf')
+    known = {}  # covered -> (least distance to decide the other users, exact, car)
+
+    def complete(covered, budget, even_left, detour_left):
+        """The least distance the users not in covered can add, or a lower bound
+        on it that is at least budget. The first driver left either drives one
+        of its cars or rides in the car of a later driver."""
+        bound, exact, _ = known.get(covered, (0, False, None))
+        bound = max(bound, even_left, detour_left)
+        if exact or bound >= budget:
+            return bound
+        d = next((d for d in drivers if not covered & bit[d]), None)
+        if d is None:
+            best, car = limit * sum(1 for p in passengers if not covered & bit[p]), None
+        else:
+            best, car = float('inf'), None
+            cap = budget
+            for mask, dist, driver, riders, charge, detour_charge in cars_of[d]:
+                if mask & covered:
+                    continue
+                even_rest, detour_rest = even_left - charge, detour_left - detour_charge
+                rest = even_rest if even_rest > detour_rest else detour_rest
+                if dist + rest < cap:
+                    rest = complete(covered | mask, cap - dist, even_rest, detour_rest)
+                if dist + rest < best:
+                    best, car = dist + rest, (driver, riders)
+                    cap = min(budget, best)
+        exact = d is None or best < budget
+        known[covered] = (best if exact else max(best, bound), exact, car)
+        return known[covered][0]
+
+    if complete(0, budget, sum(even.values()), sum(detour.values())) >= budget:
+        return incumbent
+    cars, covered = {}, 0
+    while known[covered][2] is not None:
+        driver, riders = known[covered][2]
+        cars[driver] = riders
+        covered |= sum(bit[u] for u in riders | {driver})
+    solution = state.copy()
+    riding = set(chain.from_iterable(cars.values()))
+    for driver in solution.drivers:
+        id = driver.user['id']
+        if id in cars:
+            driver.set_route(*routes[id, cars[id]])
+        else:
+            driver.set_route(None, [], [])
+    solution.actual_drivers = [d for d in solution.drivers if d.user['id'] in cars]
+    solution.drivers_with_no_passengers = [d for d in solution.actual_drivers
+                                           if not cars[d.user['id']]]
+    solution.remaining_passengers = [p for p in solution.passengers if p['id'] not in riding]
+    solution.reset_fingerprint()
+    return solution
+
 
 class State:
-    def __init__(self, n=200, m=100, num_streets=100, max_drive_distance=300):
+    def __init__(self, n=200, m=100, num_streets=100, max_drive_distance=300,
+                 route_cache=None, capacity=2, oracle=None):
         self.N = n
         self.M = m
         self.NUM_STREETS = num_streets
         self.MAX_DRIVE_DISTANCE = max_drive_distance
+        self.CAPACITY = capacity
         self.users = []
         self.passengers = []
         self.drivers = []
@@ -91,32 +883,253 @@ class State:
         self.drivers_with_no_passengers = []
         self.remaining_passengers = []
         self.drivers_index = [None] * self.N
+        self.table = UserTable(oracle=oracle)
+        # With a RouteCache, swapped drivers take the optimal routes for their riders
+        self.route_cache = route_cache
+        # XOR of the keys of the drivers, kept up to date as routes change
+        self._fingerprint = 0
 
-    def generate_random_problem (self):
-        self.__generate_users()
-        self.__generate_drivers_passengers()
+    def generate_random_problem(self, seed=None):
+        """Place the users at random and choose the passengers at random, with
+        a random.Random(seed) if a seed is given and the random module if not."""
+        rng = random.Random(seed) if seed is not None else random
+        self.__generate_users(rng)
+        self.__generate_drivers_passengers(rng)
 
-    def __generate_users(self):
+    def __generate_users(self, rng):
         for i in range(self.N):
             user = {}
             user['id'] = i
-            user['origin'] = [random.randrange(self.NUM_STREETS) for _ in range(2)]
-            user['destination'] = [random.randrange(self.NUM_STREETS) for _ in range(2)]
+            user['origin'] = [rng.randrange(self.NUM_STREETS) for _ in range(2)]
+            user['destination'] = [rng.randrange(self.NUM_STREETS) for _ in range(2)]
             self.users.append(user)
+            self.table.add(user)
 
-    def __generate_drivers_passengers(self):
+    def __generate_drivers_passengers(self, rng):
         users_sequence = range(self.N)
-        passengers = random.sample(users_sequence, self.M)
+        passengers = rng.sample(users_sequence, self.M)
         for i in users_sequence:
             if i in passengers:
                 self.passengers.append(self.users[i])
             else:
-                self.drivers.append(Driver(self.users[i]))
+                self.drivers.append(Driver(self.users[i], self.table, self.CAPACITY,
+                                           self.MAX_DRIVE_DISTANCE))
                 self.drivers_index[i] = self.drivers[-1]
         self.remaining_passengers = list(self.passengers)
         self.drivers_with_no_passengers = list(self.drivers)
         self.actual_drivers = list(self.drivers)
 
+    def successor(self):
+        """Return a shallow copy of this state. Users and drivers are shared with
+        this state, so a driver must be cloned with own_driver before changing it."""
+        new_state = copy.copy(self)
+        new_state.drivers = list(self.drivers)
+        new_state.actual_drivers = list(self.actual_drivers)
+        new_state.drivers_with_no_passengers = list(self.drivers_with_no_passengers)
+        new_state.remaining_passengers = list(self.remaining_passengers)
+        new_state.drivers_index = list(self.drivers_index)
+        return new_state
+
+    def copy(self):
+        """Return a copy of this state that shares no driver with it, so that it
+        can be changed in place (see CO2.apply)."""
+        new_state = self.successor()
+        clones = {id(d): d.copy() for d in self.drivers}
+        for drivers in (new_state.drivers, new_state.actual_drivers,
+                        new_state.drivers_with_no_passengers):
+            drivers[:] = [clones[id(d)] for d in drivers]
+        new_state.drivers_index = [d and clones[id(d)] for d in self.drivers_index]
+        return new_state
+
+    def fingerprint(self):
+        """A hash of the routes of the state: the XOR of the keys of its drivers,
+        as in Zobrist hashing. The methods of State that change a route update it
+        in O(1); after changing drivers directly, call reset_fingerprint."""
+        if self._fingerprint is None:
+            self._fingerprint = 0
+            for driver in self.drivers:
+                self._fingerprint ^= driver.key()
+        return self._fingerprint
+
+    def reset_fingerprint(self):
+        """Recompute the fingerprint from the drivers when it is next needed."""
+        self._fingerprint = None
+
+    def __rekey(self, driver, old_key):
+        """Update the fingerprint after the key of the driver changed from old_key."""
+        if self._fingerprint is not None:
+            self._fingerprint ^= old_key ^ driver.key()
+
+    def __hash__(self):
+        return self.fingerprint()
+
+    def __eq__(self, other):
+        """States are equal if they have the same users and every driver has the
+        same route in both (so the same riders, drivers and waiting passengers)."""
+        if not isinstance(other, State):
+            return NotImplemented
+        if self is other:
+            return True
+        if self.fingerprint() != other.fingerprint() or len(self.users) != len(other.users):
+            return False
+        if self.users is not other.users and self.users != other.users:
+            return False
+        for driver, other_driver in zip(self.drivers_index, other.drivers_index):
+            if (driver is None) != (other_driver is None):
+                return False
+            if driver is not other_driver and driver is not None and \
+                    (driver.ids != other_driver.ids or driver.ops != other_driver.ops):
+                return False
+        return True
+
+    def own_driver(self, id):
+        """Replace the driver with the given id by a private copy and return it."""
+        old_driver = self.drivers_index[id]
+        driver = old_driver.copy()
+        self.drivers_index[id] = driver
+        for drivers in (self.drivers, self.actual_drivers, self.drivers_with_no_passengers):
+            try:
+                drivers[drivers.index(old_driver)] = driver
+            except ValueError:
+                pass
+        return driver
+
+    def own_users(self):
+        """Give this state its own lists of users and passengers and its own user
+        table, so that users can be added and removed without affecting the
+        states it was copied from. Its drivers must not be shared (see copy)."""
+        self.users = list(self.users)
+        self.passengers = list(self.passengers)
+        self.table = self.table.copy()
+        for driver in self.drivers:
+            driver.table = self.table
+
+    def dumps(self):
+        """The state as compact bytes for State.loads: a JSON header with the
+        parameters, then arrays of the coordinates, the routes as ids and ops,
+        and the ids in each list of users and drivers. The oracle of the table
+        and the route cache are not included."""
+        slots = len(self.users)
+        kinds = array('b', (0 if user is None else 1 if self.drivers_index[i] is None else 2
+                            for i, user in enumerate(self.users)))
+        drivers = self.drivers
+        arrays = [
+            kinds, array('i', self.table.xs[:2*slots]), array('i', self.table.ys[:2*slots]),
+            array('i', (d.user['id'] for d in drivers)),
+            array('b', (d.capacity for d in drivers)),
+            array('d', (d.max_distance for d in drivers)),
+            array('i', (len(d.ids) for d in drivers)),
+            array('i', chain.from_iterable(d.ids for d in drivers)),
+            array('b', chain.from_iterable(d.ops for d in drivers)),
+            array('i', (d.user['id'] for d in self.actual_drivers)),
+            array('i', (d.user['id'] for d in self.drivers_with_no_passengers)),
+            array('i', (p['id'] for p in self.passengers)),
+            array('i', (p['id'] for p in self.remaining_passengers)),
+        ]
+        header = json.dumps({'N': self.N, 'M': self.M, 'NUM_STREETS': self.NUM_STREETS,
+                             'MAX_DRIVE_DISTANCE': self.MAX_DRIVE_DISTANCE,
+                             'CAPACITY': self.CAPACITY, 'byteorder': sys.byteorder}).encode()
+        parts = [STATE_MAGIC, struct.pack('<I', len(header)), header]
+        for a in arrays:
+            parts.append(struct.pack('<cI', a.typecode.encode(), len(a)))
+            parts.append(a.tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def loads(cls, data, oracle=None, route_cache=None):
+        """The state written by dumps, with the given distance oracle and route cache."""
+        if data[:len(STATE_MAGIC)] != STATE_MAGIC:
+            raise ValueError('not a CO2 state')
+        offset = len(STATE_MAGIC) + 4
+        size, = struct.unpack_from('<I', data, offset - 4)
+        header = json.loads(data[offset:offset + size].decode())
+        offset += size
+        arrays = []
+        while offset < len(data):
+            typecode, length = struct.unpack_from('<cI', data, offset)
+            a = array(typecode.decode())
+            offset += struct.calcsize('<cI')
+            a.frombytes(data[offset:offset + length * a.itemsize])
+            if header['byteorder'] != sys.byteorder:
+                a.byteswap()
+            offset += length * a.itemsize
+            arrays.append(a)
+        (kinds, xs, ys, driver_ids, capacities, max_distances, lengths, ids, ops,
+         actual, idle, passengers, remaining) = arrays
+        state = cls(len(kinds), header['M'], header['NUM_STREETS'], header['MAX_DRIVE_DISTANCE'],
+                    route_cache, header['CAPACITY'], oracle)
+        state.N = header['N']
+        for i, kind in enumerate(kinds):
+            user = {'id': i, 'origin': [xs[2*i], ys[2*i]],
+                    'destination': [xs[2*i+1], ys[2*i+1]]} if kind else None
+            state.users.append(user)
+            if user is not None:
+                state.table.add(user)
+        starts = list(accumulate(chain([0], lengths)))
+        for k, id in enumerate(driver_ids):
+            # max distances are written as doubles; integral ones come back as ints
+            max_distance = max_distances[k]
+            if max_distance.is_integer():
+                max_distance = int(max_distance)
+            driver = Driver(state.users[id], state.table, capacities[k], max_distance)
+            driver.set_route(None, ids[starts[k]:starts[k+1]], ops[starts[k]:starts[k+1]])
+            state.drivers.append(driver)
+            state.drivers_index[id] = driver
+        state.reset_fingerprint()
+        state.actual_drivers = [state.drivers_index[id] for id in actual]
+        state.drivers_with_no_passengers = [state.drivers_index[id] for id in idle]
+        state.passengers = [state.users[id] for id in passengers]
+        state.remaining_passengers = [state.users[id] for id in remaining]
+        return state
+
+    def add_user(self, origin, destination, driver=False, capacity=None, max_distance=None):
+        """Add a new user, who drives alone or waits as a passenger; return it. A
+        driver's car has the capacity and max_distance of the state by default."""
+        user = {'id': len(self.users), 'origin': list(origin), 'destination': list(destination)}
+        self.users.append(user)
+        self.table.add(user)
+        self.drivers_index.append(None)
+        self.N += 1
+        if driver:
+            self.drivers_index[user['id']] = Driver(user, self.table, capacity or self.CAPACITY,
+                                                    max_distance or self.MAX_DRIVE_DISTANCE)
+            self.drivers.append(self.drivers_index[user['id']])
+            self.actual_drivers.append(self.drivers[-1])
+            self.drivers_with_no_passengers.append(self.drivers[-1])
+        else:
+            self.M += 1
+            self.passengers.append(user)
+            self.remaining_passengers.append(user)
+        return user
+
+    def remove_user(self, id, carrier=None):
+        """Take the user out of the problem; its id is not reused. carrier is the
+        driver who carries the user, if any and if known (it is searched for
+        otherwise). Return the users that were riding with the user if it was a
+        driver: they are waiting again."""
+        user = self.users[id]
+        if carrier is None:
+            carrier = next((d for d in self.actual_drivers if d.has_passenger(user)), None)
+        if carrier is not None:
+            self.remove_passenger_from_driver(user, carrier)
+        orphans = []
+        driver = self.drivers_index[id]
+        if driver is None:
+            self.remaining_passengers.remove(user)
+            self.passengers.remove(user)
+            self.M -= 1
+        else:
+            for rider in driver.get_passengers():
+                self.remove_passenger_from_driver(rider, driver)
+                orphans.append(rider)
+            self.drivers.remove(driver)
+            self.actual_drivers.remove(driver)
+            self.drivers_with_no_passengers.remove(driver)
+            self.drivers_index[id] = None
+        self.users[id] = None
+        self.N -= 1
+        return orphans
+
     def get_user(self, id):
         return self.users[id]
 
@@ -135,50 +1148,115 @@ class State:
 
         return dist
 
-    def swap_best_passengers(self, driver1, driver2):
+    def best_swap(self, driver1, driver2):
+        """Find the exchange of one passenger of driver1 with one of driver2 that
+        most reduces their joint distance, without changing either driver. Return
+        {'dist': new joint distance, 'passenger_d1': passenger moving to driver1,
+        'passenger_d2': passenger moving to driver2}, or None if no swap helps."""
+        if self.route_cache is not None:
+            return self.__best_cached_swap(driver1, driver2)
+        # into1[i][j]: best insertion of the j-th passenger of driver2 into driver1
+        # without its i-th passenger; into2[j][i] the other way round
+        passengers1, passengers2 = driver1.get_passengers(), driver2.get_passengers()
+        into1 = [driver1.insertions(passengers2, p1['id']) for p1 in passengers1]
+        into2 = [driver2.insertions(passengers1, p2['id']) for p2 in passengers2]
         old_distance = driver1.distance() + driver2.distance()
         min_dist = {'dist': old_distance, 'passenger_d1': None, 'passenger_d2': None}
-        for p1, p2 in product(driver1.get_passengers(), driver2.get_passengers()):
-            cdriver1 = copy.deepcopy(driver1)
-            cdriver2 = copy.deepcopy(driver2)
-
-            cdriver1.remove_passenger(p1)
-            cdriver2.remove_passenger(p2)
-
-            cdriver1.add_passenger(p2)
-            cdriver2.add_passenger(p1)
-            if cdriver1.has_passenger(p2) and cdriver2.has_passenger(p1) and \
-                            min_dist['dist'] > cdriver1.distance() + cdriver2.distance():
-                min_dist['dist'] = cdriver1.distance() + cdriver2.distance()
+        for (i, p1), (j, p2) in product(enumerate(passengers1), enumerate(passengers2)):
+            insertion1, insertion2 = into1[i][j], into2[j][i]
+            if insertion1 is not None and insertion2 is not None and \
+                    min_dist['dist'] > insertion1['dist'] + insertion2['dist']:
+                min_dist['dist'] = insertion1['dist'] + insertion2['dist']
                 min_dist['passenger_d1'] = p2
                 min_dist['passenger_d2'] = p1
+        if min_dist['dist'] < old_distance:
+            return min_dist
+        return None
+
+    def __swapped_route(self, driver, leaving, joining):
+        """The cached route of driver once `leaving` gives its place to `joining`."""
+        riders = [id for id, op in zip(driver.ids, driver.ops) if op == TAKE and id != leaving]
+        return self.route_cache.route(driver, riders + [joining])
 
+    def __best_cached_swap(self, driver1, driver2):
+        old_distance = driver1.distance() + driver2.distance()
+        min_dist = {'dist': old_distance, 'passenger_d1': None, 'passenger_d2': None}
+        for p1, p2 in product(driver1.get_passengers(), driver2.get_passengers()):
+            route1 = self.__swapped_route(driver1, p1['id'], p2['id'])
+            if route1 is None or route1[0] >= min_dist['dist']:
+                continue
+            route2 = self.__swapped_route(driver2, p2['id'], p1['id'])
+            if route2 is not None and route1[0] + route2[0] < min_dist['dist']:
+                min_dist = {'dist': route1[0] + route2[0], 'passenger_d1': p2, 'passenger_d2': p1}
         if min_dist['dist'] < old_distance:
+            return min_dist
+        return None
+
+    def swap_best_passengers(self, driver1, driver2):
+        keys = driver1.key(), driver2.key()
+        swapped = self.__swap_best_passengers(driver1, driver2)
+        self.__rekey(driver1, keys[0])
+        self.__rekey(driver2, keys[1])
+        return swapped
+
+    def __swap_best_passengers(self, driver1, driver2):
+        best = self.best_swap(driver1, driver2)
+        if best is not None and self.route_cache is not None:
+            route1 = self.__swapped_route(driver1, best['passenger_d2']['id'],
+                                          best['passenger_d1']['id'])
+            route2 = self.__swapped_route(driver2, best['passenger_d1']['id'],
+                                          best['passenger_d2']['id'])
+            driver1.set_route(*route1)
+            driver2.set_route(*route2)
+            return [best['passenger_d1'], best['passenger_d2']]
+        if best is not None:
             # Actually swap passengers
-            pos = driver1.remove_passenger(min_dist['passenger_d2'])
+            pos = driver1.remove_passenger(best['passenger_d2'])
             assert(len(pos) == 2)
-            pos = driver2.remove_passenger(min_dist['passenger_d1'])
+            pos = driver2.remove_passenger(best['passenger_d1'])
             assert(len(pos) == 2)
-            driver1.add_passenger(min_dist['passenger_d1'])
-            driver2.add_passenger(min_dist['passenger_d2'])
-            return [p1,p2]
+            driver1.add_passenger(best['passenger_d1'])
+            driver2.add_passenger(best['passenger_d2'])
+            return [best['passenger_d1'], best['passenger_d2']]
         return []
 
     def add_passenger_to_driver(self, passenger, driver):
+        key = driver.key()
         added = driver.add_passenger(passenger)
         if added:
+            self.__rekey(driver, key)
             self.remaining_passengers.remove(passenger)
             if driver in self.drivers_with_no_passengers:
                 self.drivers_with_no_passengers.remove(driver)
+        return added
 
     def add_driver_as_passenger(self, driver, driver_as_passenger):
+        key = driver.key()
         added = driver.add_passenger(driver_as_passenger.user)
         if added:
+            self.__rekey(driver, key)
             self.drivers_with_no_passengers.remove(driver_as_passenger)
             self.actual_drivers.remove(driver_as_passenger)
             if driver in self.drivers_with_no_passengers:
                 self.drivers_with_no_passengers.remove(driver)
 
+    def remove_passenger_from_driver(self, user, driver):
+        """Undo add_passenger_to_driver or add_driver_as_passenger: the user waits
+        again, as a remaining passenger or as a driver with no passengers."""
+        key = driver.key()
+        if not driver.remove_passenger(user):
+            return False
+        self.__rekey(driver, key)
+        if not driver.get_passengers():
+            self.drivers_with_no_passengers.append(driver)
+        rider = self.get_driver(user['id'])
+        if rider is None:
+            self.remaining_passengers.append(user)
+        else:
+            self.actual_drivers.append(rider)
+            self.drivers_with_no_passengers.append(rider)
+        return True
+
     def __str__(self):
         s = "Actual drivers: \n"
         for d in self.actual_drivers:
@@ -186,90 +1264,418 @@ class State:
         return s
 
 
+STATE_MAGIC = b'CO2S'
+
+
 class TravelOp(Enum):
     TAKE = 1
     DROP = 2
 
 
+TAKE, DROP = TravelOp.TAKE.value, TravelOp.DROP.value
+
+
+class ManhattanDistance:
+    """The distance between points of a UserTable in a grid city: the Manhattan
+    distance between their coordinates. This is the default distance oracle.
+    An oracle locates coordinates in its city and gives the distance between
+    two points of a table, from a point to several others (and from several to
+    one, which is the same if the oracle is symmetric) and along a path."""
+
+    symmetric = True
+
+    def locate(self, coordinates):
+        """The node of the city at the coordinates; no nodes are needed here."""
+        return -1
+
+    def distance(self, table, p, q):
+        return abs(table.xs[p] - table.xs[q]) + abs(table.ys[p] - table.ys[q])
+
+    def distances(self, table, p, points):
+        xs, ys = table.xs, table.ys
+        x, y = xs[p], ys[p]
+        return [abs(xs[q] - x) + abs(ys[q] - y) for q in points]
+
+    def distances_to(self, table, points, q):
+        return self.distances(table, q, points)
+
+    def legs(self, table, points):
+        xs, ys = table.xs, table.ys
+        return [abs(xs[p] - xs[q]) + abs(ys[p] - ys[q]) for p, q in zip(points, points[1:])]
+
+
+class DistanceMatrix:
+    """Shortest distances between the nodes of a street graph, as a flat
+    row-major matrix: matrix[i * len(nodes) + j] goes from nodes[i] to nodes[j].
+    A coordinate pair is located at the node with those coordinates or, if the
+    graph has locations, at the nearest one. Build it from a search.Graph with
+    from_graph, and save it for MappedDistanceMatrix. It is not pickled, so it
+    is never copied into the payload of every worker: map it instead."""
+
+    def __init__(self, nodes, matrix, locations=None, symmetric=False):
+        self.nodes = list(nodes)
+        self.index = {node: i for i, node in enumerate(self.nodes)}
+        self.matrix = matrix
+        self.locations = locations
+        self.symmetric = symmetric
+        self.located = {}
+
+    @classmethod
+    def from_graph(cls, graph):
+        """All the shortest distances of the graph, by a Dijkstra search from every node."""
+        nodes = sorted(set(graph.nodes()) | set(chain.from_iterable(
+            graph.get(a) for a in graph.nodes())), key=repr)
+        index = {node: i for i, node in enumerate(nodes)}
+        links = [[(index[b], d) for b, d in graph.get(a).items()] for a in nodes]
+        typecode = 'l' if all(isinstance(d, int) for row in links for _, d in row) else 'd'
+        matrix = array(typecode)
+        for source in range(len(nodes)):
+            dist = [None] * len(nodes)
+            frontier = [(0, source)]
+            while frontier:
+                d, i = heapq.heappop(frontier)
+                if dist[i] is not None:
+                    continue
+                dist[i] = d
+                for j, length in links[i]:
+                    if dist[j] is None:
+                        heapq.heappush(frontier, (d + length, j))
+            if None in dist:
+                raise ValueError('{} cannot reach every node'.format(nodes[source]))
+            matrix.extend(dist)
+        locations = getattr(graph, 'locations', None)
+        return cls(nodes, matrix, [locations[node] for node in nodes] if locations else None,
+                   not graph.directed)
+
+    def save(self, path):
+        """Write the matrix to a file that MappedDistanceMatrix can map: a line of
+        JSON with the nodes, padded to a multiple of 8 bytes, then the matrix."""
+        header = json.dumps({'nodes': self.nodes, 'locations': self.locations,
+                             'symmetric': self.symmetric,
+                             'typecode': self.matrix.typecode}).encode()
+        header += b' ' * (-(len(header) + 1) % 8) + b'\n'
+        with open(path, 'wb') as f:
+            f.write(header)
+            f.write(memoryview(self.matrix).cast('B'))
+
+    def locate(self, coordinates):
+        key = tuple(coordinates)
+        if key in self.index:
+            return self.index[key]
+        if key not in self.located:
+            if not self.locations:
+                raise KeyError('no node at {}'.format(coordinates))
+            self.located[key] = min(range(len(self.nodes)), key=lambda i: sum(
+                (a - b)**2 for a, b in zip(self.locations[i], coordinates)))
+        return self.located[key]
+
+    def distance(self, table, p, q):
+        return self.matrix[table.nodes[p] * len(self.nodes) + table.nodes[q]]
+
+    def distances(self, table, p, points):
+        matrix, nodes = self.matrix, table.nodes
+        row = nodes[p] * len(self.nodes)
+        return [matrix[row + nodes[q]] for q in points]
+
+    def distances_to(self, table, points, q):
+        matrix, nodes, n = self.matrix, table.nodes, len(self.nodes)
+        column = nodes[q]
+        return [matrix[nodes[p] * n + column] for p in points]
+
+    def legs(self, table, points):
+        matrix, nodes, n = self.matrix, table.nodes, len(self.nodes)
+        return [matrix[nodes[p] * n + nodes[q]] for p, q in zip(points, points[1:])]
+
+    def __getstate__(self):
+        raise TypeError('a DistanceMatrix is not sent to other processes: save it '
+                        'and share a MappedDistanceMatrix of the file instead')
+
+
+class MappedDistanceMatrix(DistanceMatrix):
+    """A DistanceMatrix read from a file written by DistanceMatrix.save through a
+    memory map, so processes that use the same file share its pages instead of
+    copying the matrix: it is pickled as just the path of the file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start = self.map.find(b'\n') + 1
+        header = json.loads(self.map[:start].decode())
+        nodes = [tuple(node) if isinstance(node, list) else node for node in header['nodes']]
+        DistanceMatrix.__init__(self, nodes, memoryview(self.map)[start:].cast(header['typecode']),
+                                header['locations'], header['symmetric'])
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+
+def street_graph(num_streets=100, jam=0.3):
+    """A random city of num_streets x num_streets crossings, named by their
+    coordinates, where each block takes 1 to drive, or 3 with probability jam."""
+    graph = search.UndirectedGraph()
+    for x, y in product(range(num_streets), repeat=2):
+        for neighbor in ((x + 1, y), (x, y + 1)):
+            if max(neighbor) < num_streets:
+                graph.connect((x, y), neighbor, 3 if random.random() < jam else 1)
+    graph.locations = {node: node for node in graph.nodes()}
+    return graph
+
+
+class UserTable:
+    """The users of a problem and the coordinates of their origins and
+    destinations, indexed by user id. Point 2*id is the origin of user id and
+    point 2*id+1 its destination, so xs[point] and ys[point] are its coordinates
+    and nodes[point] is where the distance oracle locates it."""
+
+    def __init__(self, users=(), oracle=None):
+        self.users = []
+        self.xs = array('l')
+        self.ys = array('l')
+        self.nodes = array('l')
+        self.oracle = oracle if oracle is not None else ManhattanDistance()
+        for user in users:
+            self.add(user)
+
+    def add(self, user):
+        """Register a user, unless a user with the same id is already there."""
+        id = user['id']
+        if id < len(self.users) and self.users[id] is not None:
+            return
+        if id >= len(self.users):
+            grow = id + 1 - len(self.users)
+            self.users.extend([None] * grow)
+            self.xs.extend([0] * 2 * grow)
+            self.ys.extend([0] * 2 * grow)
+            self.nodes.extend([0] * 2 * grow)
+        self.users[id] = user
+        self.xs[2*id], self.ys[2*id] = user['origin']
+        self.xs[2*id+1], self.ys[2*id+1] = user['destination']
+        self.nodes[2*id] = self.oracle.locate(user['origin'])
+        self.nodes[2*id+1] = self.oracle.locate(user['destination'])
+
+    def copy(self):
+        """A table with the same users that can be added to independently."""
+        table = UserTable(oracle=self.oracle)
+        table.users = list(self.users)
+        table.xs, table.ys = array('l', self.xs), array('l', self.ys)
+        table.nodes = array('l', self.nodes)
+        return table
+
+    def route_distance(self, points):
+        """Length of the path that visits the points in order."""
+        return sum(self.oracle.legs(self, points))
+
+    def point_distance(self, p, q):
+        """Distance from point p to point q."""
+        return self.oracle.distance(self, p, q)
+
+    def distances(self, p, points):
+        """The distances from point p to each of the points."""
+        return self.oracle.distances(self, p, points)
+
+    def distances_to(self, points, q):
+        """The distances from each of the points to point q."""
+        return self.oracle.distances_to(self, points, q)
+
+
+class UserGrid:
+    """Users bucketed by the grid cell of their origin, to find quickly the
+    users whose origin lies in a rectangle. bounds is the bounding box of the
+    origins and destinations of all the users."""
+
+    def __init__(self, table, users, cell=10):
+        self.table = table
+        self.cell = cell
+        self.users = users
+        self.cells = defaultdict(list)
+        for user in users:
+            p = 2 * user['id']
+            self.cells[table.xs[p] // cell, table.ys[p] // cell].append(user)
+        points = [2 * user['id'] + k for user in users for k in (0, 1)]
+        xs = [table.xs[p] for p in points]
+        ys = [table.ys[p] for p in points]
+        self.bounds = (min(xs), min(ys), max(xs), max(ys)) if points else (0, 0, 0, 0)
+
+    def within(self, xmin, ymin, xmax, ymax):
+        """Users whose origin may lie in the rectangle (whole cells are returned)."""
+        c = self.cell
+        for i in range(xmin // c, xmax // c + 1):
+            for j in range(ymin // c, ymax // c + 1):
+                yield from self.cells.get((i, j), ())
+
+
+def box_distance(x, y, box):
+    """Manhattan distance from the point (x, y) to the box (xmin, ymin, xmax, ymax)."""
+    xmin, ymin, xmax, ymax = box
+    return max(xmin - x, 0, x - xmax) + max(ymin - y, 0, y - ymax)
+
+
+def farthest_box_distance(box, other):
+    """The largest Manhattan distance from a point of the box other to the box."""
+    return (max(box[0] - other[0], other[2] - box[2], 0)
+            + max(box[1] - other[1], other[3] - box[3], 0))
+
+
+def _first_full(occupancy, capacity):
+    """first_full[i] is the first j >= i where the car is full after j stops, or
+    len(occupancy) if it never is."""
+    first_full = [len(occupancy)] * len(occupancy)
+    full = len(occupancy)
+    for i in reversed(range(len(occupancy))):
+        if occupancy[i] >= capacity:
+            full = i
+        first_full[i] = full
+    return first_full
+
+
 class Driver:
-    def __init__(self, user):
+    """A driver and its route. The route is kept as two parallel arrays: ids[i]
+    is the passenger of the i-th stop and ops[i] is TAKE or DROP. Coordinates
+    are looked up in a UserTable, usually shared by all the drivers of a State.
+    The car takes up to `capacity` passengers at a time and drives at most
+    max_distance; the number of passengers after every stop is kept up to date
+    as passengers are added and removed, so that whether one more fits between
+    two stops is known in O(1)."""
+
+    def __init__(self, user, table=None, capacity=2, max_distance=300):
         self.user = user
-        self.travel = []  # a list of {'op': take/drop, 'passenger': user}
+        self.table = table if table is not None else UserTable()
+        self.table.add(user)
+        self.capacity = capacity
+        self.max_distance = max_distance
+        self.ids = array('l')
+        self.ops = array('b')
+        self._occupancy = array('b', [0])
+        self._first_full = None
+        self._distance = None
+        self._key = 0
+
+    @property
+    def travel(self):
+        """The route as a list of {'op': take/drop, 'passenger': user}."""
+        users = self.table.users
+        return [{'op': TravelOp(op), 'passenger': users[id]} for id, op in zip(self.ids, self.ops)]
+
+    def copy(self):
+        """Return a copy of this driver with its own route arrays. The user table
+        and the user dicts are shared, as they are never modified."""
+        driver = copy.copy(self)
+        driver.ids = array('l', self.ids)
+        driver.ops = array('b', self.ops)
+        return driver
+
+    def points(self):
+        """The points the driver visits, from its origin to its destination."""
+        id = self.user['id']
+        return [2*id] + [2*p + op - TAKE for p, op in zip(self.ids, self.ops)] + [2*id + 1]
+
+    def bounds(self):
+        """The bounding box (xmin, ymin, xmax, ymax) of the points of the route."""
+        points = self.points()
+        xs = [self.table.xs[p] for p in points]
+        ys = [self.table.ys[p] for p in points]
+        return min(xs), min(ys), max(xs), max(ys)
 
     def distance(self):
-        if not self.travel:
-            return manhattan_distance(self.user['origin'], self.user['destination'])
-        else:
-            dist = manhattan_distance(self.user['origin'], self.travel[0]['passenger']['origin'])
-            for i in range(len(self.travel)-1):
-                org = self.__get_passenger_origin_or_dest_upon_travelop(i)
-                dest = self.__get_passenger_origin_or_dest_upon_travelop(i+1)
-                dist += manhattan_distance(org, dest)
-            dist += manhattan_distance(self.travel[-1]['passenger']['destination'], self.user['destination'])
-            return dist
-
-    def __get_passenger_origin_or_dest_upon_travelop(self, i):
-        return self.travel[i]['passenger']['origin'] if self.travel[i]['op'] == TravelOp.TAKE \
-                else self.travel[i]['passenger']['destination']
-
-    def __calculate_legal_takes_drops(self):
-        take = 0
-        legal_takes_drops = []
-        for t in range(len(self.travel)):
-            for d in range(t, len(self.travel)+1):
-                if self.__is_legal_take_drop_op(t, d):
-                    legal_takes_drops.append([t,d])
-        legal_takes_drops.append([len(self.travel), len(self.travel)])
-        return legal_takes_drops
-
-    def __is_legal_take_drop_op(self, t, d):
-        take = 0
-        for op in self.travel[0:t]:
-            if op['op'] == TravelOp.TAKE:
-                take += 1
-            else:
-                take -= 1
-        if take >= 2:
-            return False
+        if self._distance is None:
+            self._distance = self.table.route_distance(self.points())
+        return self._distance
+
+    def key(self):
+        """A hash of the driver and its route, or 0 if the route is empty (see
+        State.fingerprint)."""
+        if self._key is None:
+            # hashes of tuples of ints, unlike those of bytes, are the same in
+            # every process, so keys of pickled drivers stay valid
+            self._key = hash((self.user['id'], tuple(self.ids), tuple(self.ops))) \
+                if self.ids else 0
+        return self._key
+
+    def slack(self):
+        """How much longer the route may get."""
+        return self.max_distance - self.distance()
+
+    def occupancy(self):
+        """occupancy()[i] is the number of passengers in the car after the first i stops."""
+        return list(self._occupancy)
+
+    def first_full(self):
+        """first_full()[i] is the first stop j >= i after which the car is full (or
+        len(route) + 1): a passenger taken before stop t and dropped before stop d
+        fits in the car if and only if d < first_full()[t]."""
+        if self._first_full is None:
+            self._first_full = _first_full(self._occupancy, self.capacity)
+        return self._first_full
+
+    def best_insertion(self, passenger):
+        """Find the cheapest legal positions to take and drop the passenger, without
+        changing the route. Return {'dist': new distance, 'pos': [take, drop]}, or
+        None if every way of taking the passenger drives more than max_distance.
+        Taking at t and dropping at d means the passenger is picked up just before
+        stop t and dropped just before stop d of the current route, so each of the
+        O(L^2) candidates is scored in O(1) from the detours it adds to legs t and d."""
+        return self.insertions([passenger])[0]
 
-        take += 1
-        for op in self.travel[t:d]:
-            if op['op'] == TravelOp.TAKE:
-                take += 1
+    def insertions(self, passengers, without=None):
+        """best_insertion of each of the passengers, into the route the driver would
+        have without the stops of the user whose id is `without` (if any). That
+        route, its legs and the (t, d) positions where a passenger fits in the car
+        are computed once for all the passengers, and the route is not changed."""
+        for passenger in passengers:
+            self.table.add(passenger)
+        table = self.table
+        id = self.user['id']
+        stops = [(p, op) for p, op in zip(self.ids, self.ops) if p != without]
+        points = [2*id] + [2*p + op - TAKE for p, op in stops] + [2*id + 1]
+        n = len(stops)
+        oracle = table.oracle
+        legs = oracle.legs(table, points)
+        distance = sum(legs)
+        if n == len(self.ids):
+            first_full = self.first_full()
+        else:
+            take, drop = self.__find_pos_passenger(self.table.users[without])
+            first_full = _first_full(self.__removed(self._occupancy, take, drop), self.capacity)
+        spans = [(t, d) for t in range(n+1) for d in range(t, first_full[t])]
+        results = []
+        for passenger in passengers:
+            origin, destination = 2*passenger['id'], 2*passenger['id'] + 1
+            trip = oracle.distance(table, origin, destination)
+            from_origin = oracle.distances(table, origin, points)
+            from_destination = oracle.distances(table, destination, points)
+            if oracle.symmetric:
+                to_origin, to_destination = from_origin, from_destination
             else:
-                take -= 1
-            if take > 2:
-                return False
-        if take <= 2:
-            return True
+                to_origin = oracle.distances_to(table, points, origin)
+                to_destination = oracle.distances_to(table, points, destination)
+            # detour of visiting the origin (destination) alone between points i and i+1
+            origin_detour = [to_origin[i] + from_origin[i+1] - legs[i] for i in range(n+1)]
+            destination_detour = [to_destination[i] + from_destination[i+1] - legs[i]
+                                  for i in range(n+1)]
+            min_dist = {'dist': sys.maxsize, 'pos': [0, 0]}
+            for t, d in spans:
+                if d == t:
+                    delta = to_origin[t] + trip + from_destination[t+1] - legs[t]
+                else:
+                    delta = origin_detour[t] + destination_detour[d]
+                if delta < min_dist['dist']:
+                    min_dist = {'dist': delta, 'pos': [t, d]}
+            min_dist['dist'] += distance
+            results.append(min_dist if min_dist['dist'] <= self.max_distance else None)
+        return results
 
     # mandatory or not
     def add_passenger(self, passenger):
         added = False
-        if not self.travel:
-            self.travel.insert(0, {'op': TravelOp.TAKE, 'passenger': passenger})
-            self.travel.insert(1, {'op': TravelOp.DROP, 'passenger': passenger})
+        best = self.best_insertion(passenger)
+        if best is not None:
+            self.__insert(passenger['id'], best['pos'][0], best['pos'][1] + 1)
+            self._distance = best['dist']
             added = True
-            if self.distance() > 300:
-                self.travel.pop()
-                self.travel.pop()
-                added = False
-        else:
-            l = len(self.travel)
-            min_dist = {'dist': sys.maxsize, 'pos': [0,0]}
-            legal_takes_pos = self.__calculate_legal_takes_drops()
-            for p in legal_takes_pos:
-                self.travel.insert(p[1], {'op': TravelOp.DROP, 'passenger': passenger})
-                self.travel.insert(p[0], {'op': TravelOp.TAKE, 'passenger': passenger})
-                dist = self.distance()
-                if dist < min_dist['dist']:
-                    min_dist = {'dist': dist, 'pos': p}
-                self.travel.pop(p[0])
-                self.travel.pop(p[1])
-            if min_dist['dist'] <= 300:
-                self.travel.insert(min_dist['pos'][1], {'op': TravelOp.DROP, 'passenger': passenger})
-                self.travel.insert(min_dist['pos'][0], {'op': TravelOp.TAKE, 'passenger': passenger})
-                added = True
         if self.is_over_occupied():
             print('Overocupied: {}'.format(self.travel))
         assert(not self.is_over_occupied())
@@ -277,67 +1683,740 @@ class Driver:
 
     def add_passenger_in_pos(self, passenger, pos_take, pos_drop):
         # insert first the take operation and then the drop one
-        self.travel.insert(pos_take, {'op': TravelOp.TAKE, 'passenger': passenger})
-        self.travel.insert(pos_drop, {'op': TravelOp.DROP, 'passenger': passenger})
+        self.table.add(passenger)
+        self.__insert(passenger['id'], pos_take, pos_drop)
         assert(not self.is_over_occupied())
 
+    def __insert(self, id, pos_take, pos_drop):
+        # pos_drop is the position of the drop once the take has been inserted
+        self.ids.insert(pos_take, id)
+        self.ops.insert(pos_take, TAKE)
+        self.ids.insert(pos_drop, id)
+        self.ops.insert(pos_drop, DROP)
+        # one more passenger after the stops from the take to the drop
+        occupancy = self._occupancy
+        self._occupancy = occupancy[:pos_take+1] + \
+            array('b', (o + 1 for o in occupancy[pos_take:pos_drop])) + occupancy[pos_drop-1:]
+        self._first_full = None
+        self._distance = None
+        self._key = None
+
+    @staticmethod
+    def __removed(occupancy, take, drop):
+        """The occupancy once the stops take and drop (of the same passenger) are removed."""
+        return occupancy[:take+1] + array('b', (o - 1 for o in occupancy[take+2:drop+1])) + \
+            occupancy[drop+2:]
+
+    def set_route(self, distance, ids, ops):
+        """Replace the route, as returned by optimal_route (distance may be None)."""
+        self.ids, self.ops = array('l', ids), array('b', ops)
+        self._occupancy = array('b', accumulate(chain(
+            [0], (1 if op == TAKE else -1 for op in ops))))
+        self._first_full = None
+        self._distance = distance
+        self._key = None
+
     def is_over_occupied(self):
-        take = 0
-        for op in self.travel:
-            if op['op'] == TravelOp.TAKE:
-                take += 1
-            else:
-                take -= 1
-            if take > 2:
-                return True
-        return False
+        return max(self._occupancy) > self.capacity
 
     def get_passengers(self):
-        return [op['passenger'] for op in self.travel if op['op'] == TravelOp.TAKE]
+        users = self.table.users
+        return [users[id] for id, op in zip(self.ids, self.ops) if op == TAKE]
 
     def has_passenger(self, passenger):
-        return passenger in self.get_passengers()
+        return passenger['id'] in self.ids
+
+    def removal_distance(self, user):
+        """The distance of the route once the user is taken out of it."""
+        id = user['id']
+        return self.table.route_distance([p for p in self.points() if p // 2 != id])
 
     def remove_passenger(self, user):
         pos = self.__find_pos_passenger(user)
         if pos:
-            self.travel.pop(pos[1])  # drop operation
-            self.travel.pop(pos[0])  # take operation
+            for i in reversed(pos):  # drop operation first, then the take one
+                self.ids.pop(i)
+                self.ops.pop(i)
+            self._occupancy = self.__removed(self._occupancy, *pos)
+            self._first_full = None
+            self._distance = None
+            self._key = None
         return pos
 
     def __find_pos_passenger(self, user):
-        pos = []
-        idx = 0
-        for op in self.travel:
-            if op['passenger']['id'] == user['id']:
-                pos.append(idx)
-            idx += 1
+        id = user['id']
+        pos = [i for i, p in enumerate(self.ids) if p == id]
         assert(len(pos) == 2 or not pos)
         return pos
 
     def __str__(self):
         return 'driver: {} Route: {}'.format(self.user['id'], self.travel)
 
-"""
-This is going to call the Hill Climbing algorithm
-"""
+# ______________________________________________________________________________
+# Online assignment
+
+
+class OnlineCarpool:
+    """Keeps a State up to date while users arrive and leave. Every change is
+    repaired by best insertion into the drivers (or of the waiting passengers)
+    whose origins are nearest to it, found in grids of driver and waiting
+    passenger origins, so a request touches `neighbors` drivers at most."""
+
+    def __init__(self, state=None, neighbors=20, cell=10):
+        self.state = state.copy() if state is not None else State(n=0, m=0)
+        self.state.own_users()
+        self.neighbors = neighbors
+        self.cell = cell
+        # no driver reaches a point farther than this from its origin
+        self.reach = max([self.state.MAX_DRIVE_DISTANCE]
+                         + [d.max_distance for d in self.state.drivers])
+        self.drivers_grid = defaultdict(set)
+        self.waiting_grid = defaultdict(set)
+        self.carrier = {}  # rider id -> driver
+        for driver in self.state.actual_drivers:
+            self.drivers_grid[self.__cell(driver.user)].add(driver.user['id'])
+            for rider in driver.get_passengers():
+                self.carrier[rider['id']] = driver
+        for user in self.state.remaining_passengers:
+            self.waiting_grid[self.__cell(user)].add(user['id'])
+
+    def add_passenger(self, origin, destination):
+        """A passenger arrives: give it to the nearby driver it costs least to.
+        Return its id."""
+        user = self.state.add_user(origin, destination)
+        self.waiting_grid[self.__cell(user)].add(user['id'])
+        self.__place(user)
+        return user['id']
+
+    def add_driver(self, origin, destination, capacity=None, max_distance=None):
+        """A driver arrives: let it take nearby waiting passengers. Return its id."""
+        user = self.state.add_user(origin, destination, True, capacity, max_distance)
+        self.reach = max(self.reach, self.state.get_driver(user['id']).max_distance)
+        self.drivers_grid[self.__cell(user)].add(user['id'])
+        self.__fill(self.state.get_driver(user['id']))
+        return user['id']
+
+    def remove(self, id):
+        """A user leaves. Its driver, if it had one, takes nearby waiting
+        passengers; its riders, if it was driving, look for another driver."""
+        state = self.state
+        user = state.get_user(id)
+        carrier = self.carrier.pop(id, None)
+        if state.get_driver(id) is not None:
+            self.drivers_grid[self.__cell(user)].discard(id)
+        elif carrier is None:
+            self.waiting_grid[self.__cell(user)].discard(id)
+        orphans = state.remove_user(id, carrier)
+        for rider in orphans:
+            del self.carrier[rider['id']]
+            if state.get_driver(rider['id']) is not None:
+                self.drivers_grid[self.__cell(rider)].add(rider['id'])
+                self.__fill(state.get_driver(rider['id']))
+            else:
+                self.waiting_grid[self.__cell(rider)].add(rider['id'])
+                self.__place(rider)
+        if carrier is not None:
+            self.__fill(carrier)
+
+    def __cell(self, user):
+        return user['origin'][0] // self.cell, user['origin'][1] // self.cell
+
+    def __nearest(self, grid, user):
+        """About the `neighbors` ids of grid nearest to the origin of user: whole
+        rings of cells around it are taken until there are enough of them."""
+        ci, cj = self.__cell(user)
+        found = list(grid.get((ci, cj), ()))
+        reach = self.reach // self.cell + 1
+        for r in range(1, reach + 1):
+            if len(found) >= self.neighbors:
+                break
+            for i in range(ci - r, ci + r + 1):
+                for j in ((cj - r, cj + r) if abs(i - ci) < r else range(cj - r, cj + r + 1)):
+                    found.extend(grid.get((i, j), ()))
+        return found
+
+    def __place(self, passenger):
+        state = self.state
+        best, best_driver = state.MAX_DRIVE_DISTANCE, None
+        for id in self.__nearest(self.drivers_grid, passenger):
+            driver = state.get_driver(id)
+            insertion = driver.best_insertion(passenger)
+            if insertion is not None and insertion['dist'] - driver.distance() < best:
+                best, best_driver = insertion['dist'] - driver.distance(), driver
+        if best_driver is not None:
+            state.add_passenger_to_driver(passenger, best_driver)
+            self.waiting_grid[self.__cell(passenger)].discard(passenger['id'])
+            self.carrier[passenger['id']] = best_driver
+
+    def __fill(self, driver):
+        state = self.state
+        if driver not in state.actual_drivers:
+            return
+        for id in self.__nearest(self.waiting_grid, driver.user):
+            passenger = state.get_user(id)
+            if state.add_passenger_to_driver(passenger, driver):
+                self.waiting_grid[self.__cell(passenger)].discard(id)
+                self.carrier[id] = driver
+
+
+# ______________________________________________________________________________
+# Benchmarks
+
+
+def benchmark_expansion(n=1000, m=500, sample=2000):
+    """Time CO2.result on the actions of the first hill-climbing step of a random
+    problem. Only `sample` evenly spaced actions are expanded; the time of the
+    whole step is extrapolated from them."""
+    state = State(n=n, m=m)
+    state.generate_random_problem()
+    problem = CO2(state)
+    actions = problem.actions(state)
+    stride = max(1, len(actions) // sample)
+    sampled = actions[::stride]
+    start = time.perf_counter()
+    for action in sampled:
+        problem.result(state, action)
+    per_action = (time.perf_counter() - start) / len(sampled)
+    print('n={} m={} actions={} result: {:.1f} us/action, {:.2f} s/step'.format(
+        n, m, len(actions), per_action * 1e6, per_action * len(actions)))
+    return per_action
+
+
+def benchmark_parallel_step(n=200, m=100, workers=(1, 4, 8), steps=5):
+    """Time the scoring of the neighbors of the first hill-climbing steps of a
+    random problem, sequentially and on process pools of each size in workers."""
+    state = State(n=n, m=m)
+    state.generate_random_problem()
+    problem = CO2(state)
+    states = [state]
+    for _ in range(steps - 1):
+        actions = problem.actions(state)
+        deltas = [problem.value_delta(state, action) for action in actions]
+        state = problem.result(state, actions[deltas.index(max(deltas))])
+        states.append(state)
+
+    def step_time(score):
+        start = time.perf_counter()
+        for s in states:
+            score(s, problem.actions(s))
+        return (time.perf_counter() - start) / len(states)
+
+    sequential = step_time(lambda s, actions: [problem.value_delta(s, a) for a in actions])
+    print('n={} m={} sequential: {:.3f} s/step'.format(n, m, sequential))
+    times = {0: sequential}
+    for w in workers:
+        with ProcessPoolExecutor(w) as executor:
+            times[w] = step_time(lambda s, actions: parallel_value_deltas(
+                problem, s, actions, executor, w))
+        print('{} workers: {:.3f} s/step, speedup {:.2f}'.format(
+            w, times[w], sequential / times[w]))
+    return times
+
+
+def benchmark_add_pruning(n=2000, m=1000, num_streets=100, assigned=0.5):
+    """Compare the 'add' actions of CO2.actions with the full product of drivers
+    and remaining passengers, on a random problem where a fraction `assigned` of
+    the passengers has been given to random drivers that accept them."""
+    state = State(n=n, m=m, num_streets=num_streets)
+    state.generate_random_problem()
+    for passenger in random.sample(state.passengers, int(assigned * m)):
+        for driver in random.sample(state.drivers, 10):
+            if driver.best_insertion(passenger) is not None:
+                state.add_passenger_to_driver(passenger, driver)
+                break
+    problem = CO2(state)
+
+    def score(actions):
+        start = time.perf_counter()
+        deltas = [problem.value_delta(state, action) for action in actions]
+        return deltas, time.perf_counter() - start
+
+    start = time.perf_counter()
+    pruned = problem.generate_add_passenger_actions(state)
+    generation = time.perf_counter() - start
+    pruned_deltas, pruned_time = score(pruned)
+    full = [['add', d, p] for d, p in product(state.drivers, state.remaining_passengers)]
+    full_deltas, full_time = score(full)
+    # Pruning is exact: every action that changes the state is still there
+    assert sorted(filter(None, pruned_deltas)) == sorted(filter(None, full_deltas))
+    print('n={} m={} streets={} remaining={}: {} of {} add candidates ({:.1%}); '
+          '{:.2f} s -> {:.2f} s ({:.2f} s indexing), speedup {:.1f}'.format(
+              n, m, num_streets, len(state.remaining_passengers), len(pruned), len(full),
+              len(pruned) / len(full), full_time, pruned_time + generation, generation,
+              full_time / (pruned_time + generation)))
+    return len(pruned), len(full)
+
+
+def benchmark_online(n=2000, m=1000, requests=5000, num_streets=100, neighbors=20):
+    """Feed an OnlineCarpool the arrivals of n users, m of them passengers, then
+    time a random stream of requests: arrivals of passengers and drivers and
+    departures of random users. Report the throughput and latency percentiles."""
+    def point():
+        return [random.randrange(num_streets) for _ in range(2)]
+    online = OnlineCarpool(neighbors=neighbors)
+    for _ in range(n):
+        if random.random() < m / n:
+            online.add_passenger(point(), point())
+        else:
+            online.add_driver(point(), point())
+    latencies = []
+    for _ in range(requests):
+        r = random.random()
+        if r < 0.3:
+            id = random.choice([u['id'] for u in online.state.users[-200:] if u is not None])
+        start = time.perf_counter()
+        if r < 0.3:
+            online.remove(id)
+        elif r < 0.8:
+            online.add_passenger(point(), point())
+        else:
+            online.add_driver(point(), point())
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    throughput = requests / sum(latencies)
+    print('{} requests: {:.0f} requests/s, p50 {:.3f} ms, p99 {:.3f} ms; '
+          '{} users, {} waiting'.format(requests, throughput, 1000 * latencies[requests // 2],
+                                        1000 * latencies[requests * 99 // 100],
+                                        online.state.N, len(online.state.remaining_passengers)))
+    return throughput
+
+
+def benchmark_swap(pairs=300, riders=6, num_streets=100):
+    """Time State.best_swap against the evaluation it replaced, which copied
+    both drivers for every pair of passengers, on random pairs of drivers that
+    were each given up to `riders` passengers while they fit."""
+    def copying_swap(driver1, driver2):
+        best = None
+        for p1, p2 in product(driver1.get_passengers(), driver2.get_passengers()):
+            cdriver1, cdriver2 = driver1.copy(), driver2.copy()
+            cdriver1.remove_passenger(p1)
+            cdriver2.remove_passenger(p2)
+            if cdriver1.add_passenger(p2) and cdriver2.add_passenger(p1):
+                dist = cdriver1.distance() + cdriver2.distance()
+                if dist < (best['dist'] if best else driver1.distance() + driver2.distance()):
+                    best = {'dist': dist, 'passenger_d1': p2, 'passenger_d2': p1}
+        return best
+
+    state = State(n=2 * pairs * (riders + 1), m=2 * pairs * riders, num_streets=num_streets)
+    state.generate_random_problem()
+    passengers = iter(state.passengers)
+    for driver in state.drivers:
+        for passenger in [next(passengers) for _ in range(riders)]:
+            state.add_passenger_to_driver(passenger, driver)
+    couples = list(zip(state.drivers[::2], state.drivers[1::2]))
+    times = {}
+    for name, swap in (('copying', copying_swap), ('best_swap', state.best_swap)):
+        start = time.perf_counter()
+        results = [swap(driver1, driver2) for driver1, driver2 in couples]
+        times[name] = time.perf_counter() - start
+        if name == 'copying':
+            expected = results
+    assert results == expected
+    average = sum(len(d.get_passengers()) for d in state.drivers) / len(state.drivers)
+    print('{} pairs of drivers with {:.1f} riders on average: {:.3f} s -> {:.3f} s, '
+          'speedup {:.1f}'.format(pairs, average, times['copying'], times['best_swap'],
+                                  times['copying'] / times['best_swap']))
+    return times
+
+
+def benchmark_route_cache(n=200, m=100, maxsize=100000, seed=0):
+    """Climb from the same random problem with the insertion swaps and with the
+    optimal routes of a RouteCache; report times, distances and cache hits."""
+    random.seed(seed)
+    state = State(n=n, m=m)
+    state.generate_random_problem()
+    results = {}
+    for name, cache in (('insertion', None), ('cached', RouteCache(maxsize))):
+        state.route_cache = cache
+        start = time.perf_counter()
+        final = delta_hill_climbing(CO2(state))
+        results[name] = (time.perf_counter() - start, final.global_distance())
+        print('{:10} {:.2f} s, distance {}{}'.format(
+            name, results[name][0], results[name][1],
+            '' if cache is None else ', {hits} hits, {misses} misses'.format(**cache.info())))
+    return results
+
+
+def benchmark_optimality_gap(n=16, m=8, seeds=range(5)):
+    """Solve random problems with n users, m of them passengers, exactly with
+    branch_and_bound and with each heuristic, and report how far the heuristics
+    are from the optimum (as a fraction of it) and how long every solver takes."""
+    heuristics = {
+        'hill_climbing': delta_hill_climbing,
+        'restarts': lambda problem: random_restart_hill_climbing(problem, restarts=4, batch=1),
+        'simulated_annealing': delta_simulated_annealing,
+        'tabu': tabu_search}
+    gaps, times = defaultdict(list), defaultdict(list)
+    for seed in seeds:
+        random.seed(seed)
+        state = State(n=n, m=m)
+        state.generate_random_problem()
+        problem = CO2(state)
+        finals = {}
+        for name, heuristic in heuristics.items():
+            start = time.perf_counter()
+            finals[name] = heuristic(problem)
+            times[name].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        incumbent = min(finals.values(), key=State.global_distance)
+        optimum = branch_and_bound(state, incumbent=incumbent).global_distance()
+        times['exact'].append(time.perf_counter() - start)
+        for name, final in finals.items():
+            gaps[name].append((final.global_distance() - optimum) / optimum)
+    for name in heuristics:
+        print('{:20} gap {:6.1%} (worst {:6.1%}), {:.3f} s'.format(
+            name, sum(gaps[name]) / len(seeds), max(gaps[name]), sum(times[name]) / len(seeds)))
+    print('{:20} {:.3f} s'.format('branch_and_bound', sum(times['exact']) / len(seeds)))
+    return gaps, times
+
+
+def benchmark_distances(n=200, m=100, num_streets=30, jam=0.3, path='co2_distances.bin',
+                        workers=4):
+    """Precompute the distances of a random street_graph, save and map them, and
+    climb from the same random problem with Manhattan distances and the mapped
+    matrix, with parallel workers scoring the neighbors. Report the times and
+    distances and how many bytes a state pickles to, against the bytes of the
+    matrix that a state with the matrix in memory would carry."""
+    random.seed(0)
+    graph = street_graph(num_streets, jam)
+    start = time.perf_counter()
+    matrix = DistanceMatrix.from_graph(graph)
+    print('all-pairs distances of {} crossings: {:.2f} s'.format(
+        len(matrix.nodes), time.perf_counter() - start))
+    matrix.save(path)
+    print('the matrix in memory: {} bytes'.format(len(matrix.matrix) * matrix.matrix.itemsize))
+    results = {}
+    try:
+        for name, oracle in (('manhattan', None), ('mapped', MappedDistanceMatrix(path))):
+            random.seed(1)
+            state = State(n=n, m=m, num_streets=num_streets, oracle=oracle)
+            state.generate_random_problem()
+            size = len(pickle.dumps(state))
+            start = time.perf_counter()
+            with ProcessPoolExecutor(workers) as executor:
+                final = delta_hill_climbing(CO2(state), executor)
+            results[name] = (time.perf_counter() - start, final.global_distance(), size)
+            print('{:10} {:.2f} s, distance {}, state pickles to {} bytes'.format(
+                name, *results[name]))
+    finally:
+        os.remove(path)
+    return results
+
+
+def benchmark_observer(n=100, m=50, path='co2_trace.jsonl'):
+    """Climb from the same random problem without an observer, with a
+    do-nothing search.SearchObserver and with a search.JSONLinesObserver to show
+    their overhead, then sum the trace to show where the time goes. For larger
+    problems, trace a run with a time budget: python -m co2 -n 1000 -t 60 --trace PATH."""
+    random.seed(0)
+    state = State(n=n, m=m)
+    state.generate_random_problem()
+    results = {}
+    try:
+        for name in ('none', 'null', 'jsonl'):
+            observer = {'none': None, 'null': search.SearchObserver(),
+                        'jsonl': search.JSONLinesObserver(path)}[name]
+            random.seed(1)
+            start = time.perf_counter()
+            delta_hill_climbing(CO2(state), observer=observer)
+            results[name] = time.perf_counter() - start
+            if observer is not None:
+                observer.close()
+            print('{:6} {:.2f} s'.format(name, results[name]))
+        with open(path) as f:
+            trace = [json.loads(line) for line in f]
+    finally:
+        os.remove(path)
+    for key in ('actions', 'successors', 'result_seconds', 'value_seconds', 'cache_hits'):
+        print('{:15} {}'.format(key, round(sum(step[key] for step in trace), 6)))
+    return results, trace
+
+
+def benchmark_checkpoint(n=1000, m=500, iterations=20000, seconds=1, path='co2_checkpoint.bin'):
+    """Compare State.dumps with pickle in size and time on a random problem,
+    then run simulated annealing with a checkpoint every `seconds` seconds and
+    report which share of the run went into saving them."""
+    random.seed(0)
+    state = State(n=n, m=m)
+    state.generate_random_problem()
+    state = delta_simulated_annealing(CO2(state), search.exp_schedule(
+        k=100, lam=10 / iterations, limit=iterations // 4))
+    for name, dump in (('dumps', State.dumps), ('pickle', pickle.dumps)):
+        start = time.perf_counter()
+        data = dump(state)
+        print('{:7} {} bytes in {:.2f} ms'.format(name, len(data),
+                                                  1000 * (time.perf_counter() - start)))
+    checkpointer = Checkpointer(path, seconds=seconds)
+    try:
+        start = time.perf_counter()
+        delta_simulated_annealing(CO2(state), search.exp_schedule(
+            k=100, lam=10 / iterations, limit=iterations), checkpoint=checkpointer)
+        elapsed = time.perf_counter() - start
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    share = checkpointer.save_seconds / elapsed
+    print('{} checkpoints in {:.2f} s: {:.3%} of the run'.format(
+        checkpointer.saves, elapsed, share))
+    return share
+
+
+def benchmark_lns(n=1000, m=500, time_budget=30, remove=10, seed=0):
+    """Give every destroy operator of large_neighborhood_search, with greedy and
+    regret-3 repair, and tabu_search the same time on the same random problem;
+    report the iterations each made and the distance each reached."""
+    state = State(n=n, m=m)
+    state.generate_random_problem(seed)
+    problem = CO2(state)
+    runs = [('tabu', None, None)] + [('lns', destroy, regret) for destroy in sorted(DESTROY)
+                                     for regret in (1, 3)]
+    results = {}
+    for name, destroy, regret in runs:
+        counter = _StepCounter()
+        random.seed(seed)
+        deadline = time.time() + time_budget
+        if name == 'tabu':
+            final = tabu_search(problem, sys.maxsize, deadline=deadline, observer=counter)
+        else:
+            final = large_neighborhood_search(problem, sys.maxsize, remove, destroy, regret,
+                                              deadline=deadline, observer=counter)
+        results[name, destroy, regret] = (counter.steps, final.global_distance())
+        print('{:5} {!s:8} {!s:5} {:7} steps, distance {}'.format(
+            name, destroy, regret, *results[name, destroy, regret]))
+    return results
+
 
-state = State(n=100, m=50)
-state.generate_random_problem()
+def benchmark_fingerprint(n=1000, m=500, moves=2000, seed=0):
+    """Time hashing the successors of random moves of a random problem with
+    their incrementally kept fingerprints and with fingerprints recomputed
+    from every driver, and count the distinct states among them."""
+    state = State(n=n, m=m)
+    state.generate_random_problem(seed)
+    problem = CO2(state)
+    random.seed(seed)
+    states = [state]
+    for _ in range(moves):
+        states.append(problem.result(states[-1], problem.random_action(states[-1], remove=0.3)))
+    start = time.perf_counter()
+    incremental = [hash(s) for s in states]
+    middle = time.perf_counter()
+    for s in states:
+        s.reset_fingerprint()
+    recomputed = [hash(s) for s in states]
+    end = time.perf_counter()
+    assert incremental == recomputed
+    print('incremental {:.2f} us, recomputed {:.2f} us per state; {} distinct of {}'.format(
+        1e6 * (middle - start) / len(states), 1e6 * (end - middle) / len(states),
+        len(set(states)), len(states)))
+    return middle - start, end - middle
 
-print('Initial global distance: {}'.format(state.global_distance()))
 
-hc = CO2(state)
+SUITE_SIZES = [(100, 50, 100), (500, 250, 100), (1000, 200, 100), (1000, 500, 100),
+               (1000, 800, 100), (1000, 500, 300), (2000, 1000, 200), (5000, 2500, 300)]
 
-print('Initial value: {}'.format(hc.value(state)))
-print()
 
-final = search.hill_climbing(hc)
+class _StepCounter(search.SearchObserver):
+    def __init__(self):
+        self.steps = 0
+
+    def step(self, step, best_value, **stats):
+        self.steps = step
+
+
+def benchmark_suite(sizes=SUITE_SIZES, solvers=('simulated_annealing', 'tabu'), seed=0,
+                    time_budget=10, iterations=20000, memory=True, results='co2_results.json'):
+    """Run each solver (a name in ALGORITHMS) on the instance generated with the
+    seed for every (n, m, num_streets) in sizes, for at most time_budget seconds
+    (the budget is checked between steps, and one step of hill climbing takes
+    minutes for thousands of users). Record the wall time, the peak memory
+    traced by tracemalloc if memory is true (which slows every run alike), the
+    steps and the final global_distance; write the records as JSON to results."""
+    import tracemalloc
+    records = []
+    for n, m, num_streets in sizes:
+        state = State(n=n, m=m, num_streets=num_streets)
+        state.generate_random_problem(seed)
+        for solver in solvers:
+            counter = _StepCounter()
+            args = argparse.Namespace(
+                deadline=time.time() + time_budget, time_budget=time_budget, observer=counter,
+                checkpointer=None, start=0, iterations=iterations, restarts=8, workers=1,
+                seed=seed, perturbation=0, remove=10, destroy='random', regret=1,
+                tabu_states=False)
+            random.seed(seed)
+            if memory:
+                tracemalloc.start()
+            start = time.perf_counter()
+            final = ALGORITHMS[solver](CO2(state), args, None)
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] if memory else None
+            tracemalloc.stop()
+            records.append({'n': n, 'm': m, 'streets': num_streets, 'seed': seed,
+                            'solver': solver, 'seconds': round(seconds, 6), 'peak_bytes': peak,
+                            'steps': counter.steps, 'distance': final.global_distance()})
+            print('{n:5} {m:5} {streets:4} {solver:20} {seconds:8.2f} s {peak_bytes!s:>11} B '
+                  '{steps:7} steps  distance {distance}'.format(**records[-1]))
+    if results:
+        with open(results, 'w') as f:
+            json.dump(records, f, indent=1)
+    return records
+
+
+def compare_benchmarks(results, baseline, time_tolerance=0.2, distance_tolerance=0.0):
+    """Compare two lists of benchmark_suite records (or the files they were
+    written to) run by run. Return the runs of results that take more time per
+    step than in baseline by more than time_tolerance, as a fraction (so runs
+    stopped by the time budget are compared by the steps they made), or whose
+    distance is longer by more than distance_tolerance, as records with the
+    baseline's 'baseline_seconds', 'baseline_steps' and 'baseline_distance'."""
+    loaded = []
+    for records in (results, baseline):
+        if isinstance(records, str):
+            with open(records) as f:
+                records = json.load(f)
+        loaded.append(records)
+    results, baseline = loaded
+
+    def key(record):
+        return tuple(record[k] for k in ('n', 'm', 'streets', 'seed', 'solver'))
+
+    before = {key(record): record for record in baseline}
+    regressions = []
+    for record in results:
+        old = before.get(key(record))
+        if old is None:
+            continue
+        per_step, old_per_step = (r['seconds'] / max(r['steps'], 1) for r in (record, old))
+        if per_step > old_per_step * (1 + time_tolerance) or \
+                record['distance'] > old['distance'] * (1 + distance_tolerance):
+            regressions.append(dict(record, baseline_seconds=old['seconds'],
+                                    baseline_steps=old['steps'],
+                                    baseline_distance=old['distance']))
+            print('regression: {n} {m} {streets} {solver}: {steps} steps in {seconds:.2f} s '
+                  '(was {baseline_steps} in {baseline_seconds:.2f} s), distance {distance} '
+                  '(was {baseline_distance})'.format(**regressions[-1]))
+    return regressions
+
+
+# ______________________________________________________________________________
+# Command line
+
+
+ALGORITHMS = {
+    'hill_climbing': lambda problem, args, executor: delta_hill_climbing(
+        problem, executor, deadline=args.deadline, observer=args.observer,
+        checkpoint=args.checkpointer, start=args.start),
+    'restarts': lambda problem, args, executor: random_restart_hill_climbing(
+        problem, args.restarts, executor, args.workers, args.time_budget, args.seed,
+        args.perturbation),
+    'aima_hill_climbing': lambda problem, args, executor: search.hill_climbing(
+        problem, args.observer),
+    'simulated_annealing': lambda problem, args, executor: delta_simulated_annealing(
+        problem, search.exp_schedule(k=100, lam=10 / args.iterations, limit=args.iterations),
+        deadline=args.deadline, observer=args.observer, checkpoint=args.checkpointer,
+        start=args.start),
+    'lns': lambda problem, args, executor: large_neighborhood_search(
+        problem, args.iterations, args.remove, args.destroy, args.regret,
+        deadline=args.deadline, observer=args.observer, checkpoint=args.checkpointer,
+        start=args.start),
+    'tabu': lambda problem, args, executor: tabu_search(
+        problem, args.iterations, deadline=args.deadline, observer=args.observer,
+        checkpoint=args.checkpointer, start=args.start, tabu_states=args.tabu_states),
+}
+
+
+def main(argv=None):
+    """Solve a random CO2 problem and print a JSON report of its timing and quality."""
+    parser = argparse.ArgumentParser(prog='python -m co2', description=main.__doc__)
+    parser.add_argument('-n', '--users', type=int, default=100)
+    parser.add_argument('-m', '--passengers', type=int, default=50)
+    parser.add_argument('--streets', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('-a', '--algorithm', choices=sorted(ALGORITHMS), default='hill_climbing')
+    parser.add_argument('-t', '--time-budget', type=float, default=None,
+                        help='seconds after which the search stops')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='processes that score neighbors or run restarts')
+    parser.add_argument('--restarts', type=int, default=8)
+    parser.add_argument('--perturbation', type=int, default=0)
+    parser.add_argument('--iterations', type=int, default=20000,
+                        help='steps of simulated annealing, tabu or large neighborhood search')
+    parser.add_argument('--tabu-states', action='store_true',
+                        help='make recent states tabu instead of the moves undoing recent moves')
+    parser.add_argument('--remove', type=int, default=10,
+                        help='riders taken out per step of large neighborhood search')
+    parser.add_argument('--destroy', choices=sorted(DESTROY), default='random',
+                        help='how large neighborhood search chooses the riders to take out')
+    parser.add_argument('--regret', type=int, default=1,
+                        help='insert by regret-k (1 is greedy) in large neighborhood search')
+    parser.add_argument('--route-cache', type=int, default=0, metavar='SIZE',
+                        help='swap with optimal routes, caching up to SIZE of them')
+    parser.add_argument('--distances', default=None, metavar='PATH',
+                        help='drive the distances of a DistanceMatrix saved to PATH')
+    parser.add_argument('--trace', default=None, metavar='PATH',
+                        help='write the statistics of every step as JSON lines to PATH')
+    parser.add_argument('--checkpoint', default=None, metavar='PATH',
+                        help='save the incumbent to PATH during the search')
+    parser.add_argument('--checkpoint-steps', type=int, default=None, metavar='N',
+                        help='save a checkpoint every N steps')
+    parser.add_argument('--checkpoint-seconds', type=float, default=60, metavar='T',
+                        help='save a checkpoint every T seconds')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue from the checkpoint, if it exists')
+    parser.add_argument('--print-state', action='store_true',
+                        help='also print the routes of the final state, to stderr')
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    start = time.perf_counter()
+    route_cache = RouteCache(args.route_cache) if args.route_cache else None
+    oracle = MappedDistanceMatrix(args.distances) if args.distances else None
+    args.start = 0
+    if args.resume and args.checkpoint and os.path.exists(args.checkpoint):
+        args.start, state = Checkpointer.load(args.checkpoint, oracle, route_cache)
+    else:
+        state = State(n=args.users, m=args.passengers, num_streets=args.streets,
+                      route_cache=route_cache, oracle=oracle)
+        state.generate_random_problem()
+    problem = CO2(state)
+    generated = time.perf_counter()
+    args.checkpointer = Checkpointer(args.checkpoint, args.checkpoint_steps,
+                                     args.checkpoint_seconds) if args.checkpoint else None
+    args.deadline = time.time() + args.time_budget if args.time_budget is not None else None
+    args.observer = search.JSONLinesObserver(args.trace) if args.trace else None
+    try:
+        if args.workers > 1:
+            with ProcessPoolExecutor(args.workers) as executor:
+                final = ALGORITHMS[args.algorithm](problem, args, executor)
+        else:
+            final = ALGORITHMS[args.algorithm](problem, args, None)
+    finally:
+        if args.observer is not None:
+            args.observer.close()
+    solved = time.perf_counter()
+
+    report = {
+        'algorithm': args.algorithm, 'users': args.users, 'passengers': args.passengers,
+        'streets': args.streets, 'seed': args.seed, 'workers': args.workers,
+        'time_budget': args.time_budget, 'distances': args.distances, 'trace': args.trace,
+        'generate_seconds': round(generated - start, 6),
+        'solve_seconds': round(solved - generated, 6),
+        'initial_distance': state.global_distance(),
+        'final_distance': final.global_distance(),
+        'final_value': problem.value(final),
+        'actual_drivers': len(final.actual_drivers),
+        'remaining_passengers': len(final.remaining_passengers),
+        'route_cache': final.route_cache.info() if final.route_cache else None,
+        'resumed_at': args.start if args.resume else None,
+        'checkpoints': args.checkpointer.saves if args.checkpointer else None,
+        'checkpoint_seconds': round(args.checkpointer.save_seconds, 6)
+        if args.checkpointer else None,
+    }
+    print(json.dumps(report, sort_keys=True))
+    if args.print_state:
+        print(final, file=sys.stderr)
+    return report
 
-print()
-print('Final global distance: {}'.format(final.global_distance()))
-print('Final value: {}'.format(hc.value(final)))
 
-print()
-print("Final state:")
-print(final)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
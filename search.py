@@ -12,10 +12,13 @@ from utils import (
 from grid import distance
 
 from collections import defaultdict
+import json
 import math
 import random
 import sys
 import bisect
+import heapq
+import time
 
 infinity = float('inf')
 
@@ -81,9 +84,13 @@ class Node:
     that if a state is arrived at by two paths, then there are two nodes with
     the same state.  Also includes the action that got us to this state, and
     the total path_cost (also known as g) to reach the node.  Other functions
-    may add an f and h value; see best_first_graph_search and astar_search for
-    an explanation of how the f and h values are handled. You will not need to
-    subclass this class."""
+    may set an f and h value (None until then); see best_first_graph_search
+    and astar_search for an explanation of how the f and h values are handled.
+    Nodes have fixed slots (these two included) rather than a __dict__,
+    because searches make millions of them. You will not need to subclass
+    this class."""
+
+    __slots__ = ('state', 'parent', 'action', 'path_cost', 'depth', 'f', 'h')
 
     def __init__(self, state, parent=None, action=None, path_cost=0):
         """Create a search tree Node, derived from a parent by an action."""
@@ -91,9 +98,8 @@ class Node:
         self.parent = parent
         self.action = action
         self.path_cost = path_cost
-        self.depth = 0
-        if parent:
-            self.depth = parent.depth + 1
+        self.depth = parent.depth + 1 if parent else 0
+        self.f = self.h = None
 
     def __repr__(self):
         return "<Node {}>".format(self.state)
@@ -115,15 +121,19 @@ class Node:
 
     def solution(self):
         """Return the sequence of actions to go from the root to this node."""
-        return [node.action for node in self.path()[1:]]
+        actions, node = [None] * self.depth, self
+        for i in range(self.depth - 1, -1, -1):
+            actions[i] = node.action
+            node = node.parent
+        return actions
 
     def path(self):
         """Return a list of nodes forming the path from the root to this node."""
-        node, path_back = self, []
-        while node:
-            path_back.append(node)
+        path, node = [None] * (self.depth + 1), self
+        for i in range(self.depth, -1, -1):
+            path[i] = node
             node = node.parent
-        return list(reversed(path_back))
+        return path
 
     # We want for a queue of nodes in breadth_first_search or
     # astar_search to have no duplicated states, so we treat nodes
@@ -268,8 +278,7 @@ def best_first_graph_search(problem, f):
             elif child in frontier:
                 incumbent = frontier[child]
                 if f(child) < f(incumbent):
-                    del frontier[incumbent]
-                    frontier.append(child)
+                    frontier.update(child)
     return None
 
 
@@ -357,20 +366,358 @@ def recursive_best_first_search(problem, h=None):
     return result
 
 
-def hill_climbing(problem):
+def iterative_deepening_astar_search(problem, h=None):
+    """IDA*: depth-first searches bounded by f = g + h, each with the bound
+    raised to the least f that went over the previous one. Only the current
+    path is kept (with an iterator over the actions not yet tried at each
+    node), so memory is linear in the depth of the solution; states already on
+    the path are not revisited."""
+    h = memoize(h or problem.h, 'h')
+    root = Node(problem.initial)
+    if problem.goal_test(root.state):
+        return root
+    bound = h(root)
+    while bound < infinity:
+        next_bound = infinity
+        on_path = {root.state}
+        stack = [(root, iter(problem.actions(root.state)))]
+        while stack:
+            node, actions = stack[-1]
+            action = next(actions, None)
+            if action is None:
+                stack.pop()
+                on_path.discard(node.state)
+                continue
+            child = node.child_node(problem, action)
+            if child.state in on_path:
+                continue
+            f = child.path_cost + h(child)
+            if f > bound:
+                next_bound = min(next_bound, f)
+            elif problem.goal_test(child.state):
+                return child
+            else:
+                on_path.add(child.state)
+                stack.append((child, iter(problem.actions(child.state))))
+        bound = next_bound
+    return None
+
+
+class _Memorized:
+
+    """A node of the tree that simplified_memory_bounded_astar_search keeps in
+    memory: its f, its children in memory, and the least f among the children
+    it has forgotten (its f again, once they have all gone)."""
+
+    __slots__ = ('node', 'f', 'parent', 'children', 'forgotten', 'expanded', 'version')
+
+    def __init__(self, node, f, parent=None):
+        self.node = node
+        self.f = f
+        self.parent = parent
+        self.children = []
+        self.forgotten = infinity
+        self.expanded = False
+        self.version = 0
+
+    def key(self):
+        """What expanding this node next could cost: f for a new leaf, else the
+        least f among its forgotten children."""
+        return self.forgotten if self.expanded else self.f
+
+
+def simplified_memory_bounded_astar_search(problem, h=None, memory=100000):
+    """SMA*: A* that keeps at most memory nodes, forgetting the worst leaf
+    into its parent when memory is full. Optimal if the path to an optimal
+    goal fits in memory; otherwise it may return a worse goal or None."""
+    h = memoize(h or problem.h, 'h')
+    node = Node(problem.initial)
+    root = _Memorized(node, h(node))
+    best, worst, size, added = [], [], 1, 0
+
+    def push(entry):
+        """(Re)file entry under its current key for expansion and deletion."""
+        nonlocal added
+        entry.version += 1
+        added += 1
+        key, depth = entry.key(), entry.node.depth
+        heapq.heappush(best, (key, -depth, added, entry.version, entry))
+        heapq.heappush(worst, (-key, depth, added, entry.version, entry))
+
+    def valid(item, entry, open=True):
+        return item[3] == entry.version and (entry.parent is not None or entry is root) \
+            and (entry.key() < infinity if open else not entry.children)
+
+    def forget(keep):
+        """Drop the worst leaf other than keep and its children; False if none."""
+        nonlocal size
+        skipped, dropped = [], False
+        while worst and not dropped:
+            item = heapq.heappop(worst)
+            entry = item[-1]
+            if entry is root or not valid(item, entry, open=False):
+                continue
+            if entry is keep or entry.parent is keep:
+                skipped.append(item)
+                continue
+            parent = entry.parent
+            parent.children.remove(entry)
+            parent.forgotten = min(parent.forgotten, entry.key())
+            entry.parent = None
+            size -= 1
+            push(parent)
+            dropped = True
+        for item in skipped:
+            heapq.heappush(worst, item)
+        return dropped
+
+    push(root)
+    while best:
+        item = heapq.heappop(best)
+        entry = item[-1]
+        if not valid(item, entry):
+            continue
+        node = entry.node
+        if problem.goal_test(node.state):
+            return node
+        bound = entry.key()
+        path, ancestor = set(), node
+        while ancestor:
+            path.add(ancestor.state)
+            ancestor = ancestor.parent
+        kept = {child.node.state for child in entry.children}
+        # f is monotone along paths, states on the path are not revisited, and
+        # nodes too deep for their path to fit in memory get f = infinity
+        children = sorted((max(bound, child.path_cost + h(child))
+                           if child.depth < memory - 1 or problem.goal_test(child.state)
+                           else infinity, i, child)
+                          for i, child in enumerate(node.expand(problem))
+                          if child.state not in path and child.state not in kept)
+        entry.expanded, entry.forgotten = True, infinity
+        while size + len(children) > memory and forget(entry):
+            pass
+        # successors that cannot fit at all are dropped
+        for f, _, child in children[:max(0, memory - size)]:
+            child = _Memorized(child, f, entry)
+            entry.children.append(child)
+            size += 1
+            push(child)
+        push(entry)
+        if len(best) + len(worst) > 4 * size + 64:
+            # drop the stale entries, so that the queues stay within memory too
+            best[:] = [item for item in best if valid(item, item[-1])]
+            worst[:] = [item for item in worst if valid(item, item[-1], open=False)]
+            heapq.heapify(best)
+            heapq.heapify(worst)
+    return None
+
+# ______________________________________________________________________________
+# Bidirectional search
+
+
+def bidirectional_breadth_first_search(problem, backward=None):
+    """Search breadth-first from the initial state and back from the goal at
+    once, a whole level of the smaller frontier at a time, until the two meet.
+    The problem must have a single goal state; backward is the problem of
+    getting from the goal back to the initial state, problem.reverse() by
+    default. Returns the node of the goal, as breadth_first_search does."""
+    backward = backward or problem.reverse()
+    node = Node(problem.initial)
+    if problem.goal_test(node.state):
+        return node
+    root = Node(backward.initial)
+    sides = [[problem, [node], {node.state: node}],
+             [backward, [root], {root.state: root}]]
+    while sides[0][1] and sides[1][1]:
+        i = 0 if len(sides[0][1]) <= len(sides[1][1]) else 1
+        side_problem, frontier, reached = sides[i]
+        other = sides[1 - i][2]
+        level = []
+        for node in frontier:
+            for child in node.expand(side_problem):
+                if child.state not in reached:
+                    if child.state in other:
+                        meeting = (child, other[child.state])
+                        return _join(problem, *(meeting if i == 0 else meeting[::-1]))
+                    reached[child.state] = child
+                    level.append(child)
+        sides[i][1] = level
+    return None
+
+
+def bidirectional_astar_search(problem, h=None, backward=None, hb=None):
+    """A* search forwards from the initial state and backwards from the goal
+    at once. h and hb (default backward.h) must be consistent; backward
+    defaults to problem.reverse(). With h = hb = 0 it is bidirectional
+    uniform cost search."""
+    backward = backward or problem.reverse()
+    node = Node(problem.initial)
+    if problem.goal_test(node.state):
+        return node
+    h, hb = h or problem.h, hb or backward.h
+    sides, last = [], []
+    # each side orders its nodes by g plus half the difference of the two
+    # estimates, which keeps the searches in step
+    for side_problem, sign in ((problem, 1), (backward, -1)):
+        frontier = PriorityQueue(min, memoize(
+            lambda n, sign=sign: n.path_cost + sign * (h(n) - hb(n)) / 2, 'f'))
+        root = Node(side_problem.initial)
+        frontier.append(root)
+        sides.append((side_problem, frontier, {root.state: root}))
+        last.append(frontier.f(root))
+    best, meeting = infinity, None
+    while sides[0][1] and sides[1][1]:
+        i = 0 if len(sides[0][1]) <= len(sides[1][1]) else 1
+        side_problem, frontier, reached = sides[i]
+        other = sides[1 - i][2]
+        node = frontier.pop()
+        last[i] = frontier.f(node)
+        # no path left unseen is shorter than the best one through a meeting state
+        if last[0] + last[1] >= best:
+            break
+        for child in node.expand(side_problem):
+            incumbent = reached.get(child.state)
+            if incumbent is None or child.path_cost < incumbent.path_cost:
+                reached[child.state] = child
+                if child in frontier:
+                    frontier.update(child)
+                else:
+                    frontier.append(child)
+                if child.state in other and child.path_cost + other[child.state].path_cost < best:
+                    best = child.path_cost + other[child.state].path_cost
+                    meeting = (child, other[child.state])
+                    if i == 1:
+                        meeting = meeting[::-1]
+    return meeting and _join(problem, *meeting)
+
+
+def _join(problem, node, backward_node):
+    """Extend node, reached from the initial state, along the path found back
+    from the goal to backward_node (which has the same state), by the actions
+    of problem that retrace it."""
+    while backward_node.parent:
+        state = backward_node.parent.state
+        action = next(action for action in problem.actions(node.state)
+                      if problem.result(node.state, action) == state)
+        node = node.child_node(problem, action)
+        backward_node = backward_node.parent
+    return node
+
+
+class SearchObserver:
+
+    """Receives a report of every step of a local search. This one ignores
+    them; subclass it and override step (and close) to record them."""
+
+    def step(self, step, best_value, **stats):
+        """Called after each step with its number, the best value found so far
+        and the statistics of the step, as ObservedProblem.stats reports them."""
+        pass
+
+    def close(self):
+        pass
+
+
+class JSONLinesObserver(SearchObserver):
+
+    """Writes each step as a line of JSON to a file (a path or an open file),
+    with the seconds elapsed since the observer was created."""
+
+    def __init__(self, file):
+        self.file = open(file, 'w') if isinstance(file, str) else file
+        self.owned = isinstance(file, str)
+        self.start = time.perf_counter()
+
+    def step(self, step, best_value, **stats):
+        stats.update(step=step, best_value=best_value,
+                     elapsed=round(time.perf_counter() - self.start, 6))
+        self.file.write(json.dumps(stats, sort_keys=True) + '\n')
+
+    def close(self):
+        if self.owned:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+class ObservedProblem(Problem):
+
+    """Delegates to a problem, and counts and times the calls a local search
+    makes to it, to report them step by step to a SearchObserver. If the
+    problem has a cache_hits(state) method, the cache hits are reported too."""
+
+    def __init__(self, problem):
+        self.problem = problem
+        self.actions_generated = self.successors = 0
+        self.result_time = self.value_time = 0.0
+        self.hits = None
+
+    def actions(self, state):
+        actions = self.problem.actions(state)
+        self.actions_generated += len(actions)
+        return actions
+
+    def result(self, state, action):
+        start = time.perf_counter()
+        result = self.problem.result(state, action)
+        self.result_time += time.perf_counter() - start
+        self.successors += 1
+        return result
+
+    def value(self, state):
+        start = time.perf_counter()
+        value = self.problem.value(state)
+        self.value_time += time.perf_counter() - start
+        return value
+
+    def goal_test(self, state):
+        return self.problem.goal_test(state)
+
+    def path_cost(self, c, state1, action, state2):
+        return self.problem.path_cost(c, state1, action, state2)
+
+    def h(self, node):
+        return self.problem.h(node)
+
+    def stats(self, state):
+        """The counts and times since the last call, and the cache hits since
+        then in the search from the state, which is the current one."""
+        stats = {'actions': self.actions_generated, 'successors': self.successors,
+                 'result_seconds': round(self.result_time, 6),
+                 'value_seconds': round(self.value_time, 6), 'cache_hits': None}
+        if hasattr(self.problem, 'cache_hits'):
+            hits = self.problem.cache_hits(state)
+            stats['cache_hits'] = hits - (self.hits or 0)
+            self.hits = hits
+        self.actions_generated = self.successors = 0
+        self.result_time = self.value_time = 0.0
+        return stats
+
+    def __getattr__(self, attr):
+        return getattr(self.problem, attr)
+
+
+def hill_climbing(problem, observer=None):
     """From the initial node, keep choosing the neighbor with highest value,
-    stopping when no neighbor is better. [Figure 4.2]"""
+    stopping when no neighbor is better. [Figure 4.2]
+    Each step is reported to the observer (a SearchObserver), if one is given."""
+    if observer is not None:
+        problem = ObservedProblem(problem)
     current = Node(problem.initial)
+    step = 0
     while True:
         neighbors = current.expand(problem)
         if not neighbors:
             break
         neighbor = argmax_random_tie(neighbors,
                                      key=lambda node: problem.value(node.state))
-        if problem.value(neighbor.state) <= problem.value(current.state):
+        value = problem.value(neighbor.state)
+        if value <= problem.value(current.state):
             break
         current = neighbor
-        print('.', end='', flush=True)
+        step += 1
+        if observer is not None:
+            observer.step(step, value, **problem.stats(current.state))
     return current.state
 
 
@@ -379,9 +726,13 @@ def exp_schedule(k=20, lam=0.005, limit=100):
     return lambda t: (k * math.exp(-lam * t) if t < limit else 0)
 
 
-def simulated_annealing(problem, schedule=exp_schedule()):
+def simulated_annealing(problem, schedule=exp_schedule(), observer=None):
     """[Figure 4.5] CAUTION: This differs from the pseudocode as it
-    returns a state instead of a Node."""
+    returns a state instead of a Node.
+    Each step is reported to the observer (a SearchObserver), if one is given."""
+    if observer is not None:
+        best_value = problem.value(problem.initial)
+        problem = ObservedProblem(problem)
     current = Node(problem.initial)
     for t in range(sys.maxsize):
         T = schedule(t)
@@ -391,9 +742,14 @@ def simulated_annealing(problem, schedule=exp_schedule()):
         if not neighbors:
             return current.state
         next = random.choice(neighbors)
-        delta_e = problem.value(next.state) - problem.value(current.state)
+        value = problem.value(next.state)
+        delta_e = value - problem.value(current.state)
         if delta_e > 0 or probability(math.exp(delta_e / T)):
             current = next
+        if observer is not None:
+            if current is next:
+                best_value = max(best_value, value)
+            observer.step(t + 1, best_value, **problem.stats(current.state))
 
 
 def and_or_graph_search(problem):
@@ -664,6 +1020,7 @@ class Graph:
     def __init__(self, dict=None, directed=True):
         self.dict = dict or {}
         self.directed = directed
+        self._reversed = None
         if not directed:
             self.make_undirected()
 
@@ -683,6 +1040,7 @@ class Graph:
     def connect1(self, A, B, distance):
         """Add a link from A to B of given distance, in one direction only."""
         self.dict.setdefault(A, {})[B] = distance
+        self._reversed = None
 
     def get(self, a, b=None):
         """Return a link distance or a dict of {node: distance} entries.
@@ -698,6 +1056,22 @@ class Graph:
         """Return a list of nodes in the graph."""
         return list(self.dict.keys())
 
+    def reversed(self):
+        """Return the graph with every link turned around. An undirected graph
+        is its own reverse; for a directed one, the reverse-adjacency index is
+        built once and kept until a link is added with connect."""
+        if not self.directed:
+            return self
+        if self._reversed is None:
+            index = Graph({a: {} for a in self.dict})
+            for a, links in self.dict.items():
+                for b, dist in links.items():
+                    index.dict.setdefault(b, {})[a] = dist
+            if hasattr(self, 'locations'):
+                index.locations = self.locations
+            self._reversed = index
+        return self._reversed
+
 
 def UndirectedGraph(dict=None):
     """Build a Graph where every edge (including future ones) goes both ways."""
@@ -711,23 +1085,47 @@ def RandomGraph(nodes=list(range(10)), min_links=2, width=400, height=300,
     Then each node is connected to the min_links nearest neighbors.
     Because inverse links are added, some nodes will have more connections.
     The distance between nodes is the hypotenuse times curvature(),
-    where curvature() defaults to a random number between 1.1 and 1.5."""
+    where curvature() defaults to a random number between 1.1 and 1.5.
+    Nearest neighbors are looked for in rings of cells around each node, so
+    graphs of many thousands of nodes are built quickly."""
     g = UndirectedGraph()
     g.locations = {}
     # Build the cities
     for node in nodes:
         g.locations[node] = (random.randrange(width), random.randrange(height))
+    # Bucket them in cells holding about one city each
+    cell = max(1, int(math.sqrt(width * height / max(len(nodes), 1))))
+    cells = defaultdict(list)
+    for i, node in enumerate(nodes):
+        x, y = g.locations[node]
+        cells[x // cell, y // cell].append((i, node))
+    rings = max(width, height) // cell + 1
+
+    def nearest(node):
+        """The nearest node not linked to node (the first in nodes if there are
+        several), or the first node if there is none."""
+        here = g.locations[node]
+        cx, cy = here[0] // cell, here[1] // cell
+        best = (infinity, 0, nodes[0])
+        for r in range(rings + 1):
+            # nodes in ring r or farther are at least (r - 1) * cell away
+            if best[0] < (r - 1) * cell:
+                break
+            for i in range(cx - r, cx + r + 1):
+                for j in ((cy - r, cy + r) if abs(i - cx) < r else range(cy - r, cy + r + 1)):
+                    for index, n in cells.get((i, j), ()):
+                        if n is node or g.get(node, n):
+                            continue
+                        candidate = (distance(g.locations[n], here), index, n)
+                        if candidate[:2] < best[:2]:
+                            best = candidate
+        return best[2]
     # Build roads from each city to at least min_links nearest neighbors.
     for i in range(min_links):
         for node in nodes:
             if len(g.get(node)) < min_links:
                 here = g.locations[node]
-
-                def distance_to_node(n):
-                    if n is node or g.get(node, n):
-                        return infinity
-                    return distance(g.locations[n], here)
-                neighbor = argmin(nodes, key=distance_to_node)
+                neighbor = nearest(node)
                 d = distance(g.locations[neighbor], here) * curvature()
                 g.connect(node, neighbor, int(d))
     return g
@@ -835,6 +1233,11 @@ class GraphProblem(Problem):
     def path_cost(self, cost_so_far, A, action, B):
         return cost_so_far + (self.graph.get(A, B) or infinity)
 
+    def reverse(self):
+        """The problem of searching from the goal back to the initial node,
+        along the links of the graph taken the other way."""
+        return GraphProblem(self.goal, self.initial, self.graph.reversed())
+
     def h(self, node):
         """h function is straight-line distance from a node's state to goal."""
         locs = getattr(self.graph, 'locations', None)
@@ -913,6 +1316,59 @@ class NQueensProblem(Problem):
         return not any(self.conflicted(state, state[col], col)
                        for col in range(len(state)))
 
+
+class SlidingPuzzle(Problem):
+
+    """The problem of sliding numbered tiles on a side x side board (3 for the
+    8-puzzle, 4 for the 15-puzzle, 5 for the 24-puzzle) into order. A state is
+    a tuple of the tiles row by row, with 0 for the blank square; the goal has
+    the tiles in order and the blank last. An action moves the blank 'UP',
+    'DOWN', 'LEFT' or 'RIGHT'. h is the Manhattan distance of the tiles from
+    their places.
+    >>> astar_search(SlidingPuzzle((1, 2, 3, 4, 0, 6, 7, 5, 8))).solution()
+    ['DOWN', 'RIGHT']
+    """
+
+    moves = {'UP': (-1, 0), 'DOWN': (1, 0), 'LEFT': (0, -1), 'RIGHT': (0, 1)}
+
+    def __init__(self, initial, side=None):
+        self.side = side or exact_sqrt(len(initial))
+        n = self.side * self.side
+        Problem.__init__(self, tuple(initial), tuple(range(1, n)) + (0,))
+
+    def actions(self, state):
+        """The moves that keep the blank on the board."""
+        row, col = divmod(state.index(0), self.side)
+        return [action for action, (dr, dc) in self.moves.items()
+                if 0 <= row + dr < self.side and 0 <= col + dc < self.side]
+
+    def result(self, state, action):
+        """Swap the blank with the tile it moves onto."""
+        blank = state.index(0)
+        dr, dc = self.moves[action]
+        tile = blank + dr * self.side + dc
+        new = list(state)
+        new[blank], new[tile] = new[tile], 0
+        return tuple(new)
+
+    def h(self, node):
+        """The sum of the Manhattan distances of the tiles from their goal."""
+        side = self.side
+        return sum(abs(i // side - (tile - 1) // side) + abs(i % side - (tile - 1) % side)
+                   for i, tile in enumerate(node.state) if tile)
+
+
+def random_sliding_puzzle(side=4, moves=40, rng=random):
+    """A SlidingPuzzle scrambled by a random walk of the blank from the goal,
+    which never undoes its previous move (so it is always solvable)."""
+    problem = SlidingPuzzle(range(side * side), side)
+    state, previous = problem.goal, None
+    opposite = dict(UP='DOWN', DOWN='UP', LEFT='RIGHT', RIGHT='LEFT')
+    for _ in range(moves):
+        action = rng.choice([a for a in problem.actions(state) if a != opposite.get(previous)])
+        state, previous = problem.result(state, action), action
+    return SlidingPuzzle(state, side)
+
 # ______________________________________________________________________________
 # Inverse Boggle: Search for a high-scoring Boggle board. A good domain for
 # iterative-repair and related search techniques, as suggested by Justin Boyan.
@@ -1190,3 +1646,155 @@ def compare_graph_searchers():
                                 GraphProblem('Q', 'WA', australia_map)],
                       header=['Searcher', 'romania_map(Arad, Bucharest)',
                               'romania_map(Oradea, Neamt)', 'australia_map'])
+
+
+def benchmark_astar(n=100000, min_links=3, pairs=20, size=10000, seed=0):
+    """Time astar_search between random pairs of nodes of a RandomGraph with n
+    nodes on a size x size square, and count the states it expands."""
+    random.seed(seed)
+    start = time.perf_counter()
+    graph = RandomGraph(list(range(n)), min_links, size, size)
+    print('RandomGraph of {} nodes: {:.2f} s'.format(n, time.perf_counter() - start))
+    results = []
+    for _ in range(pairs):
+        problem = InstrumentedProblem(GraphProblem(random.randrange(n), random.randrange(n), graph))
+        start = time.perf_counter()
+        node = astar_search(problem)
+        results.append((time.perf_counter() - start, problem.succs,
+                        node.path_cost if node else None))
+    seconds = sum(r[0] for r in results)
+    expanded = sum(r[1] for r in results)
+    print('astar_search: {} searches, {} expansions in {:.2f} s ({:.0f} per second)'.format(
+        pairs, expanded, seconds, expanded / seconds))
+    return results
+
+
+def benchmark_breadth_first_search(sides=(100, 200, 316)):
+    """Time breadth_first_search and depth_first_graph_search over the whole of
+    square grid graphs of side x side nodes (316 gives 10^5 nodes), looking for
+    a node that is not there, to show that the time per node stays flat."""
+    results = {}
+    for side in sides:
+        graph = UndirectedGraph()
+        for x in range(side):
+            for y in range(side):
+                if x + 1 < side:
+                    graph.connect((x, y), (x + 1, y))
+                if y + 1 < side:
+                    graph.connect((x, y), (x, y + 1))
+        for searcher in (breadth_first_search, depth_first_graph_search):
+            problem = GraphProblem((0, 0), (-1, -1), graph)
+            start = time.perf_counter()
+            searcher(problem)
+            seconds = time.perf_counter() - start
+            results[side, name(searcher)] = seconds
+            print('{:26} {:7} nodes: {:.2f} s, {:.2f} us per node'.format(
+                name(searcher), side * side, seconds, 1e6 * seconds / (side * side)))
+    return results
+
+
+def benchmark_bidirectional_search(n=100000, min_links=3, pairs=20, size=10000, seed=0):
+    """Compare astar_search, bidirectional_astar_search, uniform_cost_search
+    and its bidirectional version (h = 0), breadth_first_search and
+    bidirectional_breadth_first_search between random pairs of nodes of a
+    RandomGraph road map: time, states expanded on both sides, and cost."""
+    random.seed(seed)
+    graph = RandomGraph(list(range(n)), min_links, size, size)
+    pairs = [(random.randrange(n), random.randrange(n)) for _ in range(pairs)]
+    zero = lambda node: 0  # noqa
+    searchers = [('astar_search', astar_search),
+                 ('bidirectional_astar_search', bidirectional_astar_search),
+                 ('uniform_cost_search', uniform_cost_search),
+                 ('bidirectional uniform cost',
+                  lambda p, backward: bidirectional_astar_search(p, zero, backward, zero)),
+                 ('breadth_first_search', breadth_first_search),
+                 ('bidirectional_breadth_first_search', bidirectional_breadth_first_search)]
+    results = {}
+    for label, searcher in searchers:
+        seconds = expanded = cost = 0
+        for initial, goal in pairs:
+            problem = InstrumentedProblem(GraphProblem(initial, goal, graph))
+            backward = InstrumentedProblem(problem.problem.reverse())
+            start = time.perf_counter()
+            if label.startswith('bidirectional'):
+                node = searcher(problem, backward=backward)
+            else:
+                node = searcher(problem)
+            seconds += time.perf_counter() - start
+            expanded += problem.succs + backward.succs
+            cost += node.path_cost if node else 0
+        results[label] = (seconds, expanded, cost)
+        print('{:36} {:9} expansions {:8.2f} s  total cost {}'.format(
+            label, expanded, seconds, cost))
+    return results
+
+
+def benchmark_memory_bounded_search(instances=((4, 50), (4, 60), (5, 40)), memory=5000,
+                                    searchers=None, seed=0):
+    """Compare the time, states expanded and peak memory (traced by
+    tracemalloc, in a second run) of astar_search with the memory-bounded
+    searches on random SlidingPuzzles, given as (side, moves) pairs."""
+    import tracemalloc
+    rng = random.Random(seed)
+    problems = [random_sliding_puzzle(side, moves, rng) for side, moves in instances]
+    searchers = searchers or [
+        astar_search, iterative_deepening_astar_search,
+        lambda problem: simplified_memory_bounded_astar_search(problem, memory=memory),
+        recursive_best_first_search]
+    results = []
+    for (side, moves), problem in zip(instances, problems):
+        for searcher in searchers:
+            label = name(searcher).replace('<lambda>', 'simplified_memory_bounded_astar_search')
+            instrumented = InstrumentedProblem(problem)
+            start = time.perf_counter()
+            node = searcher(instrumented)
+            seconds = time.perf_counter() - start
+            tracemalloc.start()
+            searcher(problem)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results.append((side, moves, label, len(node.solution()) if node else None,
+                            instrumented.succs, seconds, peak))
+            print('{:2}x{} {:3} moves {:40} length {:3} {:8} expansions {:7.2f} s {:8.1f} kB'
+                  .format(side, side, moves, label, results[-1][3], instrumented.succs, seconds,
+                          peak / 1024))
+    return results
+
+
+def benchmark_node(n=1000000, instance=(4, 50), seed=0):
+    """Measure the bytes per Node and the nodes made per second in a chain of
+    n nodes, the time of solution() on it, and the states expanded per second
+    by astar_search on a random SlidingPuzzle of the given (side, moves)."""
+    import tracemalloc
+    f = memoize(lambda node: node.path_cost + h(node), 'f')
+    h = memoize(lambda node: 0, 'h')
+
+    def chain():
+        node = Node(None)
+        for i in range(n):
+            node = Node(None, node, None, 1.0)
+            f(node)
+        return node
+    start = time.perf_counter()
+    node = chain()
+    seconds = time.perf_counter() - start
+    del node
+    tracemalloc.start()
+    node = chain()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    node.solution()
+    solution_seconds = time.perf_counter() - start
+    problem = InstrumentedProblem(random_sliding_puzzle(*instance, rng=random.Random(seed)))
+    start = time.perf_counter()
+    astar_search(problem)
+    astar_seconds = time.perf_counter() - start
+    results = dict(bytes_per_node=size / n, nodes_per_second=n / seconds,
+                   solution_seconds=solution_seconds,
+                   astar_expansions_per_second=problem.succs / astar_seconds)
+    print('{bytes_per_node:.0f} bytes per node, {nodes_per_second:.0f} nodes per second, '
+          'solution() of {n} nodes in {solution_seconds:.3f} s, '
+          'astar_search: {astar_expansions_per_second:.0f} expansions per second'
+          .format(n=n, **results))
+    return results
@@ -0,0 +1,669 @@
+import pytest
+import json
+import pickle
+import random
+import co2
+import search
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import permutations, product
+from co2 import *  # noqa
+
+
+def random_state(n, m, seed):
+    random.seed(seed)
+    state = State(n=n, m=m)
+    state.generate_random_problem()
+    return state
+
+
+def test_successor_shares_untouched_drivers():
+    state = random_state(20, 10, 1)
+    problem = CO2(state)
+    for _ in range(10):
+        state = problem.result(state, random.choice(problem.actions(state)))
+    routes = [[(op['op'], op['passenger']['id']) for op in d.travel] for d in state.drivers]
+    for action in problem.actions(state):
+        successor = problem.result(state, action)
+        assert sum(d is not e for d, e in zip(state.drivers, successor.drivers)) <= 2
+    # the parent is left as it was
+    assert [[(op['op'], op['passenger']['id']) for op in d.travel]
+            for d in state.drivers] == routes
+
+
+def test_distance_delta():
+    state = random_state(20, 10, 2)
+    problem = CO2(state)
+    for _ in range(10):
+        state = problem.result(state, random.choice(problem.actions(state)))
+    for action in problem.actions(state):
+        delta = problem.result(state, action).global_distance() - state.global_distance()
+        assert problem.distance_delta(state, action) == delta
+        assert problem.value_delta(state, action) == -delta
+
+
+def test_driver_distance():
+    driver = Driver({'id': 0, 'origin': [0, 0], 'destination': [10, 0]})
+    assert driver.distance() == 10
+    passenger = {'id': 1, 'origin': [2, 3], 'destination': [8, 3]}
+    assert driver.add_passenger(passenger)
+    assert driver.get_passengers() == [passenger]
+    assert driver.distance() == 16
+    assert driver.remove_passenger(passenger) == [0, 1]
+    assert driver.distance() == 10
+
+
+def make_user(id, rng, num_streets=100):
+    return {'id': id,
+            'origin': [rng.randrange(num_streets) for _ in range(2)],
+            'destination': [rng.randrange(num_streets) for _ in range(2)]}
+
+
+def route_distance(driver):
+    """Distance of the route of driver, computed from the user dicts."""
+    stops = [driver.user['origin']]
+    stops += [op['passenger']['origin'] if op['op'] == TravelOp.TAKE
+              else op['passenger']['destination'] for op in driver.travel]
+    stops += [driver.user['destination']]
+    return sum(manhattan_distance(a, b) for a, b in zip(stops, stops[1:]))
+
+
+def exhaustive_insertion(driver, passenger):
+    """The insertion search Driver.add_passenger used to do: try every legal
+    (take, drop) pair in order and measure the whole resulting route."""
+    travel = driver.travel
+    n = len(travel)
+    legal = []
+    for t in range(n):
+        for d in range(t, n + 1):
+            take = sum(1 if op['op'] == TravelOp.TAKE else -1 for op in travel[:t])
+            if take >= driver.capacity:
+                continue
+            take += 1
+            for op in travel[t:d]:
+                take += 1 if op['op'] == TravelOp.TAKE else -1
+                if take > driver.capacity:
+                    break
+            else:
+                legal.append([t, d])
+    legal.append([n, n])
+    best = None
+    for t, d in legal:
+        candidate = driver.copy()
+        candidate.add_passenger_in_pos(passenger, t, d + 1)
+        dist = route_distance(candidate)
+        if best is None or dist < best['dist']:
+            best = {'dist': dist, 'pos': [t, d]}
+    return best if best['dist'] <= driver.max_distance else None
+
+
+def test_best_insertion_matches_exhaustive_search():
+    rng = random.Random(42)
+    for trial in range(300):
+        users = [make_user(i, rng) for i in range(8)]
+        table = UserTable(users)
+        driver = Driver(users[0], table)
+        for passenger in users[1:rng.randrange(2, 7)]:
+            driver.add_passenger(passenger)
+        passenger = users[7]
+        expected = exhaustive_insertion(driver, passenger)
+        assert driver.best_insertion(passenger) == expected
+        if expected is not None:
+            assert driver.add_passenger(passenger)
+            assert driver.distance() == route_distance(driver) == expected['dist']
+            assert not driver.is_over_occupied()
+
+
+def test_capacity_and_max_distance():
+    rng = random.Random(43)
+    for trial in range(100):
+        users = [make_user(i, rng, 40) for i in range(16)]
+        driver = Driver(users[0], UserTable(users), capacity=rng.randrange(1, 9),
+                        max_distance=rng.randrange(100, 600))
+        for passenger in users[1:15]:
+            expected = exhaustive_insertion(driver, passenger)
+            assert driver.best_insertion(passenger) == expected
+            assert driver.add_passenger(passenger) == (expected is not None)
+            assert driver.distance() == route_distance(driver) <= driver.max_distance
+            if driver.get_passengers() and rng.random() < 0.3:
+                driver.remove_passenger(rng.choice(driver.get_passengers()))
+            fresh = Driver(users[0], driver.table, driver.capacity)
+            fresh.set_route(None, driver.ids, driver.ops)
+            assert driver.occupancy() == fresh.occupancy()
+            assert max(driver.occupancy()) <= driver.capacity
+    state = State(n=20, m=10, capacity=4, max_drive_distance=400)
+    state.generate_random_problem(seed=0)
+    assert all(d.capacity == 4 and d.max_distance == 400 for d in state.drivers)
+    state = delta_hill_climbing(CO2(state))
+    check_consistent(state)
+    assert max(max(d.occupancy()) for d in state.drivers) > 2
+
+
+def test_best_swap_matches_copying_drivers():
+    rng = random.Random(12)
+    for trial in range(100):
+        users = [make_user(i, rng, 50) for i in range(14)]
+        state = State(n=14, m=12)
+        state.users, state.table = users, UserTable(users)
+        driver1, driver2 = Driver(users[0], state.table), Driver(users[1], state.table)
+        for passenger in users[2:8]:
+            driver1.add_passenger(passenger)
+        for passenger in users[8:]:
+            driver2.add_passenger(passenger)
+        best = None
+        for p1, p2 in product(driver1.get_passengers(), driver2.get_passengers()):
+            copy1, copy2 = driver1.copy(), driver2.copy()
+            copy1.remove_passenger(p1)
+            copy2.remove_passenger(p2)
+            assert driver1.insertions([p2], p1['id']) == [copy1.best_insertion(p2)]
+            if copy1.add_passenger(p2) and copy2.add_passenger(p1):
+                dist = copy1.distance() + copy2.distance()
+                if dist < (best['dist'] if best else driver1.distance() + driver2.distance()):
+                    best = {'dist': dist, 'passenger_d1': p2, 'passenger_d2': p1}
+        assert state.best_swap(driver1, driver2) == best
+
+
+def test_parallel_value_deltas():
+    state = random_state(30, 15, 3)
+    problem = CO2(state)
+    state = problem.result(state, problem.actions(state)[0])
+    actions = problem.actions(state)
+    with ProcessPoolExecutor(2) as executor:
+        deltas = parallel_value_deltas(problem, state, actions, executor, 3)
+    assert deltas == [problem.value_delta(state, action) for action in actions]
+    assert any(deltas)
+
+
+def check_consistent(state):
+    """Every passenger waits or rides with exactly one driver, and every driver
+    drives or rides with another one."""
+    riders = [p['id'] for d in state.actual_drivers for p in d.get_passengers()]
+    assert len(riders) == len(set(riders))
+    waiting = [p['id'] for p in state.remaining_passengers]
+    driving = [d.user['id'] for d in state.actual_drivers]
+    active = [u['id'] for u in state.users if u is not None]
+    assert len(active) == state.N
+    assert sorted(riders + waiting + driving) == active
+    assert all(not d.get_passengers() for d in state.drivers_with_no_passengers)
+    # drivers that do not drive hold no route
+    assert all(not d.get_passengers() for d in state.drivers if d not in state.actual_drivers)
+
+
+def check_random_walk(problem, state, steps, remove=0.0, in_place=False):
+    """Take steps random actions from state, each of which changes the
+    global_distance by its distance_delta, with problem.apply if in_place and
+    problem.result if not. Return the last state and the kinds of actions."""
+    codes = set()
+    for _ in range(steps):
+        action = problem.random_action(state, remove)
+        codes.add(action[0])
+        delta = problem.distance_delta(state, action)
+        distance = state.global_distance()
+        if in_place:
+            expected = problem.result(state, action)
+            problem.apply(state, action)
+            assert expected.global_distance() == state.global_distance()
+        else:
+            state = problem.result(state, action)
+        assert state.global_distance() == distance + delta
+    check_consistent(state)
+    return state, codes
+
+
+def test_random_restart_hill_climbing(monkeypatch):
+    problem = CO2(random_state(30, 15, 4))
+    state = delta_hill_climbing(problem)
+    perturbed = perturb(state, 5)
+    check_consistent(perturbed)
+    assert len(perturbed.remaining_passengers) + len(perturbed.actual_drivers) == \
+        len(state.remaining_passengers) + len(state.actual_drivers) + 5
+    best = random_restart_hill_climbing(problem, restarts=3, batch=2, seed=1, perturbation=3)
+    check_consistent(best)
+    assert best.global_distance() < problem.initial.global_distance()
+    # later climbs start from the best state even when one batch holds them all
+    starts = []
+    monkeypatch.setattr(co2, 'perturb',
+                        lambda state, k, rng: starts.append(state) or perturb(state, k, rng))
+    random.seed(2)
+    before = random.random()
+    random.seed(2)
+    best = random_restart_hill_climbing(problem, restarts=4, batch=4, seed=1, perturbation=3)
+    assert random.random() == before
+    assert len(starts) == 3 and all(s is not problem.initial for s in starts)
+    assert all(best.global_distance() <= s.global_distance() for s in starts)
+
+
+def test_add_actions_are_pruned_exactly():
+    for num_streets in (100, 300):
+        random.seed(num_streets)
+        state = State(n=80, m=40, num_streets=num_streets)
+        state.generate_random_problem()
+        for passenger in state.passengers[:20]:
+            driver = random.choice(state.drivers)
+            if driver.best_insertion(passenger) is not None:
+                state.add_passenger_to_driver(passenger, driver)
+        actions = CO2(state).generate_add_passenger_actions(state)
+        pairs = set((d.user['id'], p['id']) for _, d, p in actions)
+        assert len(pairs) == len(actions)
+        for d, p in product(state.drivers, state.remaining_passengers):
+            if d.best_insertion(p) is not None:
+                assert (d.user['id'], p['id']) in pairs
+        if num_streets == 300:
+            assert len(actions) < len(state.drivers) * len(state.remaining_passengers) / 2
+
+
+def test_main(capsys):
+    report = main(['-n', '20', '-m', '10', '--seed', '1'])
+    assert json.loads(capsys.readouterr().out) == report
+    assert report['final_distance'] < report['initial_distance']
+    assert report['final_value'] == 20 * 300 - report['final_distance']
+
+
+def test_random_action_and_apply():
+    problem = CO2(random_state(30, 15, 5))
+    initial = problem.initial.global_distance()
+    state = problem.initial.copy()
+    _, codes = check_random_walk(problem, state, 100, remove=0.2, in_place=True)
+    assert codes >= {'add', 'swap', 'remove'}
+    # apply changed the copy only
+    assert problem.initial.global_distance() == initial
+    assert not any(d.get_passengers() for d in problem.initial.drivers)
+
+
+def test_simulated_annealing_and_tabu_search():
+    problem = CO2(random_state(30, 15, 6))
+    initial = problem.initial.global_distance()
+    random.seed(6)
+    annealed = delta_simulated_annealing(problem, search.exp_schedule(50, 0.005, 2000))
+    check_consistent(annealed)
+    assert annealed.global_distance() < initial
+    tabu = tabu_search(problem, iterations=300)
+    check_consistent(tabu)
+    assert tabu.global_distance() < initial
+    # taking out a rider that is a driver is undone by driver_as_passenger
+    state = problem.initial.copy()
+    carry = next(['driver_as_passenger', d, r] for d, r in permutations(state.drivers, 2)
+                 if d.best_insertion(r.user) is not None)
+    problem.apply(state, carry)
+    remove = problem.encode_action(['remove', carry[1], carry[2].user])
+    assert problem.encode_action(carry) in co2._reverse_codes(remove)
+
+
+def test_online_carpool():
+    state = delta_hill_climbing(CO2(random_state(30, 15, 7)))
+    distance = state.global_distance()
+    online = OnlineCarpool(state, neighbors=5)
+    users = list(range(30))
+    for i in range(300):
+        point = [random.randrange(100), random.randrange(100)]
+        if i % 3 == 0:
+            id = random.choice(users)
+            users.remove(id)
+            online.remove(id)
+            assert online.state.get_user(id) is None
+        elif i % 3 == 1:
+            users.append(online.add_passenger(point, point[::-1]))
+        else:
+            users.append(online.add_driver(point, point[::-1]))
+        check_consistent(online.state)
+        assert all(d.distance() <= 300 and not d.is_over_occupied()
+                   for d in online.state.actual_drivers)
+    assert online.state.N == len(users) == 130
+    assert any(d.get_passengers() for d in online.state.actual_drivers)
+    # the state the service started from is untouched
+    assert state.N == 30 and len(state.users) == 30 and state.global_distance() == distance
+
+
+def test_optimal_route():
+    rng = random.Random(11)
+    for trial in range(100):
+        users = [make_user(i, rng) for i in range(5)]
+        table = UserTable(users)
+        riders = list(range(1, rng.randrange(1, 5)))
+        distance, ids, ops = optimal_route(table, 0, riders)
+        driver = Driver(users[0], table)
+        driver.set_route(None, ids, ops)
+        assert driver.distance() == distance and not driver.is_over_occupied()
+        stops = [(r, op) for r in riders for op in (TAKE, DROP)]
+        legal = [order for order in permutations(stops)
+                 if all(order.index((r, TAKE)) < order.index((r, DROP)) for r in riders)]
+        best = float('inf')
+        for order in legal:
+            driver.set_route(None, [r for r, _ in order], [op for _, op in order])
+            if not driver.is_over_occupied():
+                best = min(best, driver.distance())
+        assert distance == best
+        assert optimal_route(table, 0, riders, max_distance=distance - 1) is None
+
+
+def test_branch_and_bound():
+    for seed in range(3):
+        state = random_state(6, 3, seed)
+        drivers = [d.user['id'] for d in state.drivers]
+        best = float('inf')
+        # every user rides with one of the drivers or drives (or waits) itself
+        for carriers in product([None] + drivers, repeat=6):
+            riding = set(d for d in drivers if carriers[d] is not None)
+            if any(carrier == u or carrier in riding for u, carrier in enumerate(carriers)):
+                continue
+            riders = defaultdict(list)
+            for u, carrier in enumerate(carriers):
+                if carrier is not None:
+                    riders[carrier].append(u)
+            routes = [optimal_route(state.table, d, riders[d], max_distance=300) if riders[d]
+                      else [manhattan_distance(state.users[d]['origin'],
+                                               state.users[d]['destination'])]
+                      for d in drivers if carriers[d] is None]
+            if any(route is None for route in routes):
+                continue
+            waiting = sum(1 for p in state.passengers if carriers[p['id']] is None)
+            best = min(best, sum(route[0] for route in routes) + 300 * waiting)
+        exact = branch_and_bound(state)
+        check_consistent(exact)
+        assert exact.global_distance() == best
+        assert branch_and_bound(state, incumbent=exact) is exact
+        assert delta_hill_climbing(CO2(state)).global_distance() >= best
+    # from climbed states, where drivers that end up riding have passengers
+    for seed in range(5):
+        state = random_state(8, 4, seed)
+        climbed = delta_hill_climbing(CO2(state))
+        exact = branch_and_bound(climbed)
+        check_consistent(exact)
+        assert exact.global_distance() == branch_and_bound(state).global_distance()
+        assert State.loads(exact.dumps()) == exact
+
+
+def test_route_cache():
+    state = random_state(12, 6, 8)
+    cache = RouteCache(maxsize=2)
+    driver0, driver1, driver2 = state.drivers[:3]
+    riders = [p['id'] for p in state.passengers[:2]]
+    assert cache.route(driver0, riders) == optimal_route(state.table, driver0.user['id'], riders,
+                                                         2, 300)
+    cache.route(driver0, riders[::-1])
+    cache.route(driver1, [])
+    cache.route(driver0, riders)
+    cache.route(driver2, riders[:1])  # evicts driver1
+    cache.route(driver1, [])
+    assert cache.info() == {'hits': 2, 'misses': 4, 'size': 2, 'maxsize': 2}
+    # swaps with a cache give optimal routes and are scored exactly
+    state = random_state(30, 15, 9)
+    state.route_cache = RouteCache()
+    problem = CO2(state)
+    state, _ = check_random_walk(problem, state, 300)
+    assert state.route_cache.hits > state.route_cache.misses > 0
+    for driver in state.actual_drivers:
+        assert driver.distance() == route_distance(driver) <= 300
+        assert not driver.is_over_occupied()
+    # states are pickled (as parallel_value_deltas does) without their routes
+    clone = pickle.loads(pickle.dumps(state))
+    assert clone.route_cache.info() == {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 100000}
+    assert len(pickle.dumps(state)) < len(pickle.dumps(state.route_cache.routes))
+    actions = problem.actions(state)
+    with ProcessPoolExecutor(2) as executor:
+        deltas = parallel_value_deltas(problem, state, actions, executor, 3)
+    assert deltas == [problem.value_delta(state, action) for action in actions]
+
+
+def test_distance_matrix(tmp_path):
+    random.seed(12)
+    graph = street_graph(12, jam=0.5)
+    matrix = DistanceMatrix.from_graph(graph)
+    # every distance is a shortest path: no block gives a shortcut, and
+    # jammed blocks only make it longer than walking the grid
+    n = len(matrix.nodes)
+    for i, a in enumerate(matrix.nodes):
+        for b, length in graph.get(a).items():
+            j = matrix.index[b]
+            assert matrix.matrix[i * n + j] <= length
+        for j, b in enumerate(matrix.nodes):
+            assert matrix.matrix[i * n + j] >= manhattan_distance(a, b)
+    path = str(tmp_path / 'distances.bin')
+    matrix.save(path)
+    mapped = MappedDistanceMatrix(path)
+    assert mapped.nodes == matrix.nodes and list(mapped.matrix) == list(matrix.matrix)
+    assert pickle.loads(pickle.dumps(mapped)).matrix[n + 2] == matrix.matrix[n + 2]
+    # the matrix in memory is never copied into worker payloads
+    with pytest.raises(TypeError):
+        pickle.dumps(State(n=4, m=2, num_streets=12, oracle=matrix))
+    for oracle in (matrix, mapped):
+        random.seed(13)
+        state = State(n=30, m=15, num_streets=12, oracle=oracle)
+        state.generate_random_problem()
+        state, _ = check_random_walk(CO2(state), state, 200)
+        for driver in state.actual_drivers:
+            points = driver.points()
+            assert driver.distance() == sum(
+                oracle.distance(state.table, p, q) for p, q in zip(points, points[1:]))
+
+
+def test_asymmetric_distances():
+    rng = random.Random(14)
+    graph = search.Graph(directed=True)
+    for x, y in product(range(6), repeat=2):
+        for neighbor in ((x + 1, y), (x, y + 1), (x - 1, y), (x, y - 1)):
+            if 0 <= min(neighbor) and max(neighbor) < 6:
+                graph.connect1((x, y), neighbor, rng.randint(1, 4))
+    oracle = DistanceMatrix.from_graph(graph)
+    assert not oracle.symmetric
+    for trial in range(50):
+        users = [make_user(i, rng, 6) for i in range(4)]
+        table = UserTable(users, oracle=oracle)
+        driver = Driver(users[0], table, capacity=3)
+        for passenger in users[1:3]:
+            driver.add_passenger(passenger)
+        passenger = users[3]
+        best = driver.best_insertion(passenger)
+        n = len(driver.ids)
+        exhaustive = None
+        for t in range(n + 1):
+            for d in range(t, n + 1):
+                candidate = driver.copy()
+                candidate.add_passenger_in_pos(passenger, t, d + 1)
+                if exhaustive is None or candidate.distance() < exhaustive:
+                    exhaustive = candidate.distance()
+        assert best['dist'] == exhaustive
+
+
+class RecordingObserver(search.SearchObserver):
+    def __init__(self):
+        self.steps = []
+
+    def step(self, step, best_value, **stats):
+        self.steps.append(dict(stats, step=step, best_value=best_value))
+
+
+def test_observers(tmp_path):
+    problem = CO2(random_state(30, 15, 15))
+    random.seed(1)
+    plain = delta_hill_climbing(problem)
+    random.seed(1)
+    observer = RecordingObserver()
+    final = delta_hill_climbing(problem, observer=observer)
+    assert final.global_distance() == plain.global_distance()
+    assert [s['step'] for s in observer.steps] == list(range(1, len(observer.steps) + 1))
+    assert observer.steps[-1]['best_value'] == problem.value(final)
+    assert all(s['successors'] == 1 and s['actions'] > 0 and s['value_seconds'] > 0
+               for s in observer.steps)
+    assert all(s['cache_hits'] == 0 for s in observer.steps)
+    observed = search.ObservedProblem(problem)
+    assert not observed.goal_test(problem.initial)
+    assert observed.goal_test(final) == problem.goal_test(final)
+    for search_ in (delta_simulated_annealing, search.hill_climbing):
+        observer = RecordingObserver()
+        final = search_(problem, observer=observer)
+        values = [s['best_value'] for s in observer.steps]
+        assert values == sorted(values) and values[-1] >= problem.value(final)
+    path = str(tmp_path / 'trace.jsonl')
+    report = main(['-n', '20', '-m', '10', '--seed', '1', '--trace', path, '--route-cache', '10'])
+    with open(path) as f:
+        trace = [json.loads(line) for line in f]
+    assert trace[-1]['best_value'] == report['final_value']
+    assert sum(s['cache_hits'] for s in trace) == report['route_cache']['hits']
+
+
+def test_dumps_and_loads():
+    state = random_state(40, 20, 16)
+    state.own_users()
+    problem = CO2(state)
+    for _ in range(200):
+        state = problem.result(state, problem.random_action(state, remove=0.2))
+    state.remove_user(state.actual_drivers[0].user['id'])
+    state.remove_user(state.passengers[0]['id'])
+    state.add_user((3, 4), (50, 60), driver=True, capacity=3, max_distance=250)
+    loaded = State.loads(state.dumps())
+    assert len(state.dumps()) < len(pickle.dumps(state)) / 3
+    check_consistent(loaded)
+    assert loaded.global_distance() == state.global_distance()
+    assert loaded.users == state.users and loaded.N == state.N and loaded.M == state.M
+    for name in ('drivers', 'actual_drivers', 'drivers_with_no_passengers'):
+        assert [(d.user['id'], list(d.ids), list(d.ops), d.capacity, d.max_distance)
+                for d in getattr(loaded, name)] == \
+            [(d.user['id'], list(d.ids), list(d.ops), d.capacity, d.max_distance)
+             for d in getattr(state, name)]
+    assert loaded.remaining_passengers == state.remaining_passengers
+    with pytest.raises(ValueError):
+        State.loads(b'not a state')
+
+
+def test_checkpoint_and_resume(tmp_path):
+    path = str(tmp_path / 'checkpoint.bin')
+    problem = CO2(random_state(30, 15, 17))
+    checkpointer = Checkpointer(path, steps=3, seconds=None, overhead=1)
+    final = delta_hill_climbing(problem, checkpoint=checkpointer)
+    step, state = Checkpointer.load(path)
+    assert checkpointer.saves == step // 3 > 0
+    assert delta_hill_climbing(CO2(state)).global_distance() <= state.global_distance()
+    # a checkpointer that has taken all its share of the time puts saves off
+    lazy = Checkpointer(str(tmp_path / 'lazy.bin'), steps=1, overhead=0)
+    lazy.save_seconds = 1
+    delta_hill_climbing(problem, checkpoint=lazy)
+    assert lazy.saves == 0
+    args = ['-n', '20', '-m', '10', '--seed', '2', '-a', 'tabu', '--iterations', '50',
+            '--checkpoint', path, '--checkpoint-steps', '10']
+    report = main(args)
+    step, state = Checkpointer.load(path)
+    assert report['checkpoints'] >= 1 and 10 <= step <= 50
+    assert state.global_distance() >= report['final_distance']
+    resumed = main(args + ['--resume', '--iterations', '80'])
+    assert resumed['resumed_at'] == step
+    assert resumed['final_distance'] <= state.global_distance()
+    # a climb resumed on a state large enough for the grid of 'add' actions
+    big = CO2(random_state(200, 100, 18))
+    Checkpointer(path).save(5, big.result(big.initial, big.actions(big.initial)[0]))
+    step, state = Checkpointer.load(path)
+    assert all(type(d.max_distance) is int for d in state.drivers)
+    observer = RecordingObserver()
+    delta_hill_climbing(CO2(state), deadline=time.time() + 0.5, observer=observer, start=step)
+    assert observer.steps[0]['step'] == 6
+    # resumed searches go on numbering the steps from the checkpoint's
+    observer = RecordingObserver()
+    delta_hill_climbing(problem, observer=observer, start=100)
+    assert observer.steps[0]['step'] == 101
+    observer = RecordingObserver()
+    large_neighborhood_search(problem, iterations=12, remove=3, observer=observer, start=10)
+    assert [s['step'] for s in observer.steps] == [11, 12]
+
+
+def test_seeded_problems_and_benchmark_suite(tmp_path):
+    states = []
+    for noise in range(2):
+        random.seed(noise)
+        state = State(n=30, m=15)
+        state.generate_random_problem(seed=18)
+        states.append(state)
+    assert states[0].users == states[1].users
+    assert states[0].passengers == states[1].passengers
+    path = str(tmp_path / 'results.json')
+    records = benchmark_suite([(20, 10, 50)], ('hill_climbing', 'tabu'), seed=3,
+                              time_budget=60, iterations=20, results=path)
+    with open(path) as f:
+        assert json.load(f) == records
+    assert [r['solver'] for r in records] == ['hill_climbing', 'tabu']
+    assert all(r['peak_bytes'] > 0 and r['steps'] > 0 for r in records)
+    assert records[1]['steps'] == 20
+    assert compare_benchmarks(path, records) == []
+    baseline = [dict(records[0], distance=records[0]['distance'] - 1),
+                dict(records[1], seconds=records[1]['seconds'] / 2)]
+    assert [r['solver'] for r in compare_benchmarks(records, baseline)] == ['hill_climbing', 'tabu']
+
+
+def test_large_neighborhood_search():
+    state = random_state(40, 20, 19)
+    before = str(state), state.global_distance()
+    problem = CO2(state)
+    greedy = large_neighborhood_search(problem, iterations=1)
+    check_consistent(greedy)
+    assert not greedy.remaining_passengers
+    for destroy, regret in product(sorted(DESTROY), (1, 3)):
+        random.seed(20)
+        final = large_neighborhood_search(problem, iterations=30, remove=4, destroy=destroy,
+                                          regret=regret)
+        check_consistent(final)
+        assert final.global_distance() <= greedy.global_distance()
+        for driver in final.actual_drivers:
+            assert driver.distance() == route_distance(driver) <= driver.max_distance
+            assert not driver.is_over_occupied()
+        riders = [(rider, d.user['id']) for d in final.actual_drivers
+                  for rider in d.get_passengers()]
+        removed = DESTROY[destroy](final, riders, 4)
+        assert len(removed) == len(set(r['id'] for r, _ in removed)) == 4
+    assert (str(state), state.global_distance()) == before
+    # drivers with no passengers are inserted as passengers too
+    state = State(n=0, m=0)
+    for x in range(4):
+        state.add_user((x, 0), (x, 50), driver=True)
+    repair(state, [d.user for d in state.drivers], regret=2)
+    check_consistent(state)
+    assert len(state.actual_drivers) == 2 and state.global_distance() == 2 * 52
+
+
+def test_fingerprints():
+    state = random_state(30, 15, 22)
+    problem = CO2(state)
+    states = [state]
+    for _ in range(300):
+        action = problem.random_action(states[-1], remove=0.3)
+        states.append(problem.result(states[-1], action))
+    for state in states[::10]:
+        fingerprint = state.fingerprint()
+        state.reset_fingerprint()
+        assert state.fingerprint() == fingerprint
+        loaded = State.loads(state.dumps())
+        assert loaded == state and hash(loaded) == hash(state)
+        assert pickle.loads(pickle.dumps(state)) == state
+    assert states[0] == random_state(30, 15, 22)
+    routes = [tuple(sorted((d.user['id'], tuple(d.ids), tuple(d.ops)) for d in s.actual_drivers))
+              for s in states]
+    assert len(set(states)) == len(set(routes))
+    # the same riders reached in a different order
+    state = random_state(30, 15, 23)
+    driver, (p1, p2) = state.drivers[0], state.passengers[:2]
+    driver.max_distance = 10**6
+    one = state.copy()
+    one.add_passenger_to_driver(p1, one.get_driver(driver.user['id']))
+    one.add_passenger_to_driver(p2, one.get_driver(driver.user['id']))
+    other = state.copy()
+    other.add_passenger_to_driver(p2, other.get_driver(driver.user['id']))
+    other.add_passenger_to_driver(p1, other.get_driver(driver.user['id']))
+    same = list(one.get_driver(driver.user['id']).ids) == list(other.get_driver(driver.user['id']).ids)
+    assert (one == other) == same and (hash(one) == hash(other)) == same
+    other.remove_passenger_from_driver(p1, other.get_driver(driver.user['id']))
+    assert other != one and other != state
+    tabu = tabu_search(problem, iterations=100, tabu_states=True)
+    check_consistent(tabu)
+    assert tabu.global_distance() < problem.initial.global_distance()
+
+
+def test_graph_search_on_co2():
+    problem = search.InstrumentedProblem(CO2(random_state(8, 3, 24)))
+    goal = search.breadth_first_search(problem)
+    assert goal is not None and goal.state.is_final_state()
+    assert len(goal.solution()) == 3
+    node = search.best_first_graph_search(
+        problem, lambda node: node.state.global_distance())
+    assert node.state.is_final_state()
+
+
+if __name__ == '__main__':
+    pytest.main()
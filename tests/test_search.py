@@ -1,4 +1,5 @@
 import pytest
+import random
 from search import *  # noqa
 
 
@@ -7,6 +8,21 @@ vacumm_world = GraphProblemStochastic('State_1', ['State_7', 'State_8'], vacumm_
 LRTA_problem = OnlineSearchProblem('State_3', 'State_5', one_dim_state_space)
 
 
+def test_Node():
+    node = Node('Arad')
+    for city in ('Sibiu', 'Fagaras', 'Bucharest'):
+        node = node.child_node(romania_problem, city)
+    assert node.depth == 3 and node.path_cost == 450
+    assert node.solution() == ['Sibiu', 'Fagaras', 'Bucharest']
+    assert [n.state for n in node.path()] == ['Arad', 'Sibiu', 'Fagaras', 'Bucharest']
+    assert Node('Arad').solution() == [] and Node('Arad').path() == [Node('Arad')]
+    assert not hasattr(node, '__dict__') and node.f is None
+    f = memoize(lambda n: n.path_cost + 1, 'f')
+    assert f(node) == 451 and node.f == 451
+    node.path_cost = 0
+    assert f(node) == 451
+
+
 def test_breadth_first_tree_search():
     assert breadth_first_tree_search(
         romania_problem).solution() == ['Sibiu', 'Fagaras', 'Bucharest']
@@ -48,6 +64,70 @@ def test_recursive_best_first_search():
         romania_problem).solution() == ['Sibiu', 'Rimnicu', 'Pitesti', 'Bucharest']
 
 
+def test_iterative_deepening_astar_search():
+    assert iterative_deepening_astar_search(
+        romania_problem).solution() == ['Sibiu', 'Rimnicu', 'Pitesti', 'Bucharest']
+
+
+def test_simplified_memory_bounded_astar_search():
+    for memory in (100, 5):
+        assert simplified_memory_bounded_astar_search(
+            romania_problem, memory=memory).solution() == ['Sibiu', 'Rimnicu', 'Pitesti', 'Bucharest']
+    assert simplified_memory_bounded_astar_search(romania_problem, memory=3) is None
+
+
+def test_sliding_puzzle():
+    rng = random.Random(3)
+    for side, moves in ((3, 30), (4, 30)):
+        problem = random_sliding_puzzle(side, moves, rng)
+        length = len(astar_search(problem).solution())
+        for node in (iterative_deepening_astar_search(problem),
+                     simplified_memory_bounded_astar_search(problem, memory=200)):
+            assert problem.goal_test(node.state) and len(node.solution()) == length
+
+
+def test_bidirectional_breadth_first_search():
+    assert bidirectional_breadth_first_search(
+        romania_problem).solution() == ['Sibiu', 'Fagaras', 'Bucharest']
+    assert bidirectional_breadth_first_search(GraphProblem('Arad', 'Arad', romania_map)).solution() == []
+
+
+def test_bidirectional_astar_search():
+    node = bidirectional_astar_search(romania_problem)
+    assert node.solution() == ['Sibiu', 'Rimnicu', 'Pitesti', 'Bucharest']
+    assert node.path_cost == 418
+    for start in romania_map.nodes():
+        for goal in ('Bucharest', 'Neamt', 'Zerind'):
+            problem = GraphProblem(start, goal, romania_map)
+            assert (bidirectional_astar_search(problem).path_cost ==
+                    astar_search(problem).path_cost)
+            assert (len(bidirectional_breadth_first_search(problem).solution()) ==
+                    len(breadth_first_search(problem).solution()))
+
+
+def test_bidirectional_search_on_directed_graph():
+    graph = Graph(dict(A=dict(B=1, C=4), B=dict(C=1, D=5), C=dict(D=1), D=dict(A=1)))
+    problem = GraphProblem('A', 'D', graph)
+    assert graph.reversed().get('D') == dict(B=5, C=1)
+    assert bidirectional_breadth_first_search(problem).solution() == ['B', 'D']
+    node = bidirectional_astar_search(problem, h=lambda n: 0, hb=lambda n: 0)
+    assert node.solution() == ['B', 'C', 'D'] and node.path_cost == 3
+    assert bidirectional_astar_search(GraphProblem('D', 'B', graph), lambda n: 0,
+                                      hb=lambda n: 0).solution() == ['A', 'B']
+    graph.connect('A', 'E', 1)
+    assert graph.reversed().get('E') == dict(A=1)
+    assert bidirectional_breadth_first_search(GraphProblem('E', 'A', graph)) is None
+    assert bidirectional_astar_search(GraphProblem('E', 'A', graph), lambda n: 0,
+                                      hb=lambda n: 0) is None
+
+
+def test_ObservedProblem():
+    problem = ObservedProblem(romania_problem)
+    assert problem.goal_test('Bucharest') and not problem.goal_test('Arad')
+    assert astar_search(problem).solution() == ['Sibiu', 'Rimnicu', 'Pitesti', 'Bucharest']
+    assert problem.stats('Bucharest')['successors'] > 0
+
+
 def test_BoggleFinder():
     board = list('SARTELNID')
     """
@@ -243,5 +243,61 @@ def test_FIFOQueue() :
         assert test_data2[front_head - 50] == queue.pop()
         front_head += 1
 
+
+def test_PriorityQueue():
+    for order in (min, max):
+        queue = PriorityQueue(order, f=lambda item: item[0])
+        reference = []
+        for i in range(500):
+            if reference and random.random() < 0.4:
+                best = order(reference, key=lambda item: item[0])
+                assert queue.pop()[0] == best[0]
+                reference.remove(next(item for item in reference if item[0] == best[0]
+                                      and item not in queue))
+            else:
+                item = (random.randrange(50), i)
+                queue.append(item)
+                reference.append(item)
+            assert len(queue) == len(reference)
+            if reference and random.random() < 0.1:
+                item = random.choice(reference)
+                assert item in queue and queue[item] == item
+                del queue[item]
+                reference.remove(item)
+                assert item not in queue and queue[item] is None
+    # equal priorities come out in order; update moves an item
+    queue = PriorityQueue(f=len)
+    queue.extend(['ab', 'cd', 'e', 'fgh', 'ij'])
+    assert [queue.pop() for _ in range(2)] == ['e', 'ab']
+    queue = PriorityQueue(f=lambda item: priorities[item])
+    priorities = {'a': 5, 'b': 3, 'c': 4}
+    queue.extend('abc')
+    priorities['a'] = 1
+    queue.update('a')
+    priorities['b'] = 6
+    queue.update('b')
+    assert [queue.pop() for _ in range(3)] == ['a', 'c', 'b']
+    with pytest.raises(IndexError):
+        queue.pop()
+
+
+def test_queue_membership():
+    for queue in (Stack(), FIFOQueue()):
+        # unhashable items are fine until membership is tested
+        queue.extend([[1], [2]])
+        assert queue.pop() in ([1], [2]) and len(queue) == 1
+        queue.pop()
+        queue.extend([1, 2, 2, 3])
+        assert 2 in queue and 4 not in queue
+        queue.append(4)
+        assert 4 in queue
+        popped = [queue.pop() for _ in range(3)]
+        remaining = [1, 2] if isinstance(queue, Stack) else [3, 4]
+        assert popped == ([4, 3, 2] if isinstance(queue, Stack) else [1, 2, 2])
+        assert all((item in queue) == (item in remaining) for item in (1, 2, 3, 4))
+    stack = Stack([1, 2, 3])
+    assert [stack.pop(), stack.pop()] == [3, 2] and 2 not in stack and 1 in stack
+
+
 if __name__ == '__main__':
     pytest.main()
@@ -276,16 +276,16 @@ except ImportError:
 
 def memoize(fn, slot=None, maxsize=32):
     """Memoize fn: make it remember the computed value for any argument list.
-    If slot is specified, store result in that slot of first argument.
+    If slot is specified, store result in that slot of first argument
+    (where None means not computed yet).
     If slot is false, use lru_cache for caching the values."""
     if slot:
         def memoized_fn(obj, *args):
-            if hasattr(obj, slot):
-                return getattr(obj, slot)
-            else:
+            val = getattr(obj, slot, None)
+            if val is None:
                 val = fn(obj, *args)
                 setattr(obj, slot, val)
-                return val
+            return val
     else:
         @functools.lru_cache(maxsize=maxsize)
         def memoized_fn(*args):
@@ -618,8 +618,7 @@ class Queue:
         q.pop()         -- return the top item from the queue
         len(q)          -- number of items in q (also q.__len())
         item in q       -- does q contain item?
-    Note that isinstance(Stack(), Queue) is false, because we implement stacks
-    as lists.  If Python ever gets interfaces, Queue will be an interface."""
+    If Python ever gets interfaces, Queue will be an interface."""
 
     def __init__(self):
         raise NotImplementedError
@@ -629,12 +628,56 @@ class Queue:
             self.append(item)
 
 
-def Stack():
-    """Return an empty list, suitable as a Last-In-First-Out Queue."""
-    return []
+class _CountingQueue(Queue):
+
+    """A Queue that, from the first `item in q` on, counts how many times each
+    item is in it, so that membership takes O(1) time. The items must then be
+    hashable; until then (as in tree searches) they need not be."""
+
+    counts = None
+
+    def _added(self, item):
+        if self.counts is not None:
+            self.counts[item] += 1
+
+    def _removed(self, item):
+        if self.counts is not None:
+            count = self.counts[item] - 1
+            if count:
+                self.counts[item] = count
+            else:
+                del self.counts[item]
+
+    def __contains__(self, item):
+        if self.counts is None:
+            self.counts = collections.Counter(self._items())
+        return item in self.counts
+
+
+class Stack(_CountingQueue):
+
+    """A Last-In-First-Out Queue."""
+
+    def __init__(self, items=()):
+        self.stack = list(items)
 
+    def append(self, item):
+        self.stack.append(item)
+        self._added(item)
+
+    def pop(self):
+        item = self.stack.pop()
+        self._removed(item)
+        return item
+
+    def __len__(self):
+        return len(self.stack)
+
+    def _items(self):
+        return self.stack
 
-class FIFOQueue(Queue):
+
+class FIFOQueue(_CountingQueue):
 
     """A First-In-First-Out Queue."""
 
@@ -644,26 +687,31 @@ class FIFOQueue(Queue):
     def append(self, item):
         if not self.queue.maxlen or len(self.queue) < self.queue.maxlen:
             self.queue.append(item)
+            self._added(item)
         else:
             raise Exception('FIFOQueue is full')
 
     def extend(self, items):
         if not self.queue.maxlen or len(self.queue) + len(items) <= self.queue.maxlen:
-            self.queue.extend(items)
+            for item in items:
+                self.queue.append(item)
+                self._added(item)
         else:
             raise Exception('FIFOQueue max length exceeded')
 
     def pop(self):
         if len(self.queue) > 0:
-            return self.queue.popleft()
+            item = self.queue.popleft()
+            self._removed(item)
+            return item
         else :
             raise Exception('FIFOQueue is empty')
 
     def __len__(self):
         return len(self.queue)
 
-    def __contains__(self, item):
-        return item in self.queue
+    def _items(self):
+        return self.queue
 
 
 class PriorityQueue(Queue):
@@ -671,37 +719,112 @@ class PriorityQueue(Queue):
     """A queue in which the minimum (or maximum) element (as determined by f and
     order) is returned first. If order is min, the item with minimum f(x) is
     returned first; if order is max, then it is the item with maximum f(x).
-    Also supports dict-like lookup."""
+    Items with the same f(x) are returned in the order they were added.
+    Also supports dict-like lookup. The items are kept in a binary heap, with
+    an index from each (hashable) item to its entries in the heap, so append,
+    pop, update and del take O(log n) time, and `in` O(1)."""
 
     def __init__(self, order=min, f=lambda x: x):
-        self.A = []
+        self.heap = []  # entries [priority, sequence number, item, position in heap]
+        self.index = {}  # item -> its entries (usually one)
         self.order = order
         self.f = f
+        self.added = 0
+
+    def priority(self, item):
+        return self.f(item) if self.order == min else _Reversed(self.f(item))
 
     def append(self, item):
-        bisect.insort(self.A, (self.f(item), item))
+        entry = [self.priority(item), self.added, item, len(self.heap)]
+        self.added += 1
+        self.heap.append(entry)
+        self.index.setdefault(item, []).append(entry)
+        self._sift_up(entry[3])
 
     def __len__(self):
-        return len(self.A)
+        return len(self.heap)
 
     def pop(self):
-        if self.order == min:
-            return self.A.pop(0)[1]
-        else:
-            return self.A.pop()[1]
+        entry = self.heap[0]
+        self._remove(entry)
+        return entry[2]
+
+    def update(self, item):
+        """Replace the item equal to item (which must be in the queue) by item,
+        moving it to the place of f(item): a decrease-key (or increase-key)."""
+        for entry in self.index[item]:
+            entry[0], entry[2] = self.priority(item), item
+            self._sift_up(entry[3])
+            self._sift_down(entry[3])
 
     def __contains__(self, item):
-        return any(item == pair[1] for pair in self.A)
+        return item in self.index
 
     def __getitem__(self, key):
-        for _, item in self.A:
-            if item == key:
-                return item
+        entries = self.index.get(key)
+        if entries:
+            return min(entries)[2]
 
     def __delitem__(self, key):
-        for i, (value, item) in enumerate(self.A):
-            if item == key:
-                self.A.pop(i)
+        for entry in list(self.index.get(key, ())):
+            self._remove(entry)
+
+    def _remove(self, entry):
+        last = self.heap.pop()
+        if last is not entry:
+            position = entry[3]
+            self.heap[position], last[3] = last, position
+            self._sift_up(position)
+            self._sift_down(last[3])
+        entries = self.index[entry[2]]
+        entries.remove(entry)
+        if not entries:
+            del self.index[entry[2]]
+
+    def _sift_up(self, position):
+        heap = self.heap
+        entry = heap[position]
+        while position > 0:
+            parent = (position - 1) // 2
+            if not entry < heap[parent]:
+                break
+            heap[position] = heap[parent]
+            heap[position][3] = position
+            position = parent
+        heap[position], entry[3] = entry, position
+
+    def _sift_down(self, position):
+        heap = self.heap
+        entry = heap[position]
+        n = len(heap)
+        while True:
+            child = 2 * position + 1
+            if child >= n:
+                break
+            if child + 1 < n and heap[child + 1] < heap[child]:
+                child += 1
+            if not heap[child] < entry:
+                break
+            heap[position] = heap[child]
+            heap[position][3] = position
+            position = child
+        heap[position], entry[3] = entry, position
+
+
+class _Reversed:
+
+    """A priority that sorts before the smaller ones, for max PriorityQueues."""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
 
 # ______________________________________________________________________________
 # Useful Shorthands